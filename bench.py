@@ -0,0 +1,321 @@
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import platform
+import tempfile
+import contextlib
+import tracemalloc
+import multiprocessing
+from datetime import datetime
+
+import prng
+import parse
+import parseV2
+import check_winner
+import replay_reader
+from dedup_store import DedupStore
+
+# ----------------------------
+# Helpers
+# ----------------------------
+def time_call(func, paths, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for path in paths:
+            func(path)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def report(name, elapsed, count, baseline=None):
+    rate = count / elapsed if elapsed > 0 else 0
+    line = f"  {name:<28} {elapsed:8.3f}s  {rate:10.1f} replays/sec"
+    if baseline:
+        line += f"  ({baseline / elapsed:.1f}x)"
+    print(line)
+
+# ----------------------------
+# Benchmarks
+# ----------------------------
+def bench_reader(paths, repeat=3):
+    for path in paths:
+        if parse.parse_rep_file_stream(path) != replay_reader.parse_rep_file(path):
+            raise AssertionError(f"Reader output differs for {path}")
+    print(f"parse_rep_file over {len(paths)} replays (best of {repeat}):")
+    stream = time_call(parse.parse_rep_file_stream, paths, repeat)
+    report("stream (file.read)", stream, len(paths))
+    buffered = time_call(replay_reader.parse_rep_file, paths, repeat)
+    report("buffer (unpack_from)", buffered, len(paths), baseline=stream)
+    stats = replay_reader.DECODER_CACHE.stats()
+    print(f"  decoder cache: {stats['hits']} hits, {stats['misses']} misses, {stats['size']} signatures")
+
+def retained_bytes(func, path):
+    tracemalloc.start()
+    result = func(path)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size
+
+def bench_columnar(paths, repeat=3):
+    if not replay_reader.NUMPY_AVAILABLE:
+        print("Skipping columnar benchmark (numpy not available).")
+        return
+    columnar = lambda path: replay_reader.parse_rep_file(path, columnar=True)
+    print(f"Columnar messages over {len(paths)} replays (best of {repeat}):")
+    dicts = time_call(replay_reader.parse_rep_file, paths, repeat)
+    report("list of dicts", dicts, len(paths))
+    report("structured array", time_call(columnar, paths, repeat), len(paths), baseline=dicts)
+    dict_bytes = sum(retained_bytes(replay_reader.parse_rep_file, path) for path in paths)
+    table_bytes = sum(retained_bytes(columnar, path) for path in paths)
+    print(f"  retained memory: {dict_bytes / len(paths) / 1024:.1f} KiB/replay as dicts, "
+          f"{table_bytes / len(paths) / 1024:.1f} KiB/replay columnar ({dict_bytes / max(table_bytes, 1):.1f}x smaller)")
+
+# ----------------------------
+# Pipeline Benchmark Suite
+# ----------------------------
+# python bench.py suite <folder> [results.json] [baseline.json] [threshold]
+#
+# Times every stage in CASES on the .rep files in a folder (synth_replays.py
+# makes a reproducible one) and reports ops/sec, per-op latency percentiles and
+# the peak RSS while the case ran, prepare() excluded (ops/sec from the best of at least ROUNDS passes
+# over the items, latencies over every op). Each case runs in a freshly spawned process
+# inside its own temporary folder, so memory and caches of one case do not
+# leak into the next. Results are saved as JSON; given a baseline from an
+# earlier run, cases whose ops/sec dropped or whose p95 latency grew by more
+# than REGRESSION_THRESHOLD are flagged and the exit code is 1.
+RESULTS_FILE = "bench_results.json"
+REGRESSION_THRESHOLD = 0.10
+ROUNDS = 3
+MIN_SECONDS = 1.0         # Cheap cases keep repeating their items until this much time is measured
+PRNG_DRAWS = 1000         # Draws per prng op
+PRNG_SEEDS = 2000
+
+def silenced(func):
+    def call(*args):
+        with open(os.devnull, "w") as null, contextlib.redirect_stdout(null):
+            return func(*args)
+    return call
+
+def prepare_paths(paths, workdir):
+    return paths
+
+def prepare_seeds(paths, workdir):
+    return list(range(PRNG_SEEDS))
+
+def prng_draws(seed):
+    generator = prng.RandomGenerator(seed)
+    for _ in range(PRNG_DRAWS):
+        generator.get_value(0, 11)
+
+def prepare_parsed(paths, workdir):
+    """(source, data) pairs as parse.main hands them to write_parsed_file."""
+    os.makedirs("parsed", exist_ok=True)
+    items = []
+    for path in paths:
+        record, _ = silenced(parse.process_replay_file)(path)
+        if record is not None:
+            items.append((path, record["data"]))
+    return items
+
+def write_parsed(item):
+    parse.write_parsed_file(item[1], item[0])
+
+def empty_parsed_dir(items):
+    """Moves the pass's outputs aside (the workdir removal deletes them), so next_output_file never probes past them."""
+    os.rename("parsed", os.path.join(tempfile.mkdtemp(prefix="pass_", dir="."), "parsed"))
+    os.mkdir("parsed")
+
+def prepare_keys(paths, workdir):
+    """(store, source, key info) triples sharing one DedupStore over a fresh database."""
+    parseV2.DB_FILE = os.path.join(workdir, "bench_matches.db")
+    parseV2.setup_database()
+    store = DedupStore(parseV2.DB_FILE, "unique_matches", parseV2.UNIQUE_MATCH_COLUMNS, "match_key", "max_duration")
+    infos = [(path, parseV2.parse_minimal_header_for_key(path)) for path in paths]
+    return [(store, path, info) for path, info in infos if info and not info.get("invalid_version") and not info.get("unknown_faction")]
+
+def dedup_insert(item):
+    """The Pass 1 check-and-keep-longest step of parseV2.main for one replay."""
+    store, rep_file, key_info = item
+    match_key = parseV2.generate_match_key(key_info['game_sd'], key_info['map_name'], key_info['begin_timestamp'], key_info['player_hash'])
+    is_longer, stored = store.check(match_key, key_info['duration'])
+    if stored is None or is_longer:
+        store.put((match_key, rep_file, key_info['duration'], key_info['game_sd'], key_info['map_name'],
+                   key_info['begin_timestamp'], key_info['player_hash'], key_info['has_ai']))
+
+def close_store(items):
+    items[0][0].close() # The last batch is part of the inserts
+
+def prepare_outputs(paths, workdir):
+    for item in prepare_parsed(paths, workdir):
+        silenced(write_parsed)(item)
+    return sorted(os.path.abspath(p) for p in glob.glob(os.path.join("parsed", "*")) if not p.endswith(".json"))
+
+# name: (prepare(paths, workdir) -> items, op(item), unit, repeatable, finish(items) or None)
+# finish runs after each pass over the items and is timed as part of it.
+CASES = {
+    "parse_rep_file": (prepare_paths, lambda path: replay_reader.parse_rep_file(path), "replays", True, None),
+    "get_replay_info": (prepare_paths, lambda path: parseV2.get_replay_info(path, 1), "replays", True, None),
+    "parse_minimal_header_for_key": (prepare_paths, lambda path: parseV2.parse_minimal_header_for_key(path), "replays", True, None),
+    "prng_draws": (prepare_seeds, prng_draws, f"{PRNG_DRAWS} draws", True, None),
+    "write_parsed_file": (prepare_parsed, write_parsed, "replays", True, empty_parsed_dir),
+    "dedup_insert": (prepare_keys, dedup_insert, "keys", False, close_store),
+    "process_json_file": (prepare_outputs, lambda path: check_winner.process_json_file(path), "replays", True, None),
+}
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+def latency_stats(durations):
+    durations = sorted(durations)
+    return {f"p{round(q * 100)}_ms": percentile(durations, q) * 1000 for q in (0.5, 0.95, 0.99)} | \
+           {"max_ms": durations[-1] * 1000 if durations else 0.0}
+
+def proc_status_mb(field):
+    """VmRSS/VmHWM from /proc/self/status in MB; None where there is no /proc (the RSS columns read n/a)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def reset_peak_rss():
+    """Lowers VmHWM to the current RSS, so the next reading covers only what runs after. False if unsupported."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def run_case(name, paths):
+    """Runs one case in the current process; returns its result dict."""
+    prepare, op, unit, repeatable, finish = CASES[name]
+    workdir = tempfile.mkdtemp(prefix=f"bench_{name}_")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        with open(os.devnull, "w") as null, contextlib.redirect_stdout(null):
+            items = prepare(paths, workdir)
+            start_rss = proc_status_mb("VmRSS")
+            peak_reset = reset_peak_rss()
+            durations = []
+            best = None
+            passes = 0
+            while items:
+                start = len(durations)
+                for item in items:
+                    op_start = time.perf_counter()
+                    op(item)
+                    durations.append(time.perf_counter() - op_start)
+                elapsed = sum(durations[start:])
+                if finish is not None:
+                    op_start = time.perf_counter()
+                    finish(items)
+                    elapsed += time.perf_counter() - op_start
+                best = elapsed if best is None else min(best, elapsed)
+                passes += 1
+                if not repeatable or (passes >= ROUNDS and sum(durations) >= MIN_SECONDS):
+                    break
+            peak_rss = proc_status_mb("VmHWM") if peak_reset else None
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    result = {"unit": unit, "items": len(items), "passes": passes, "ops": len(durations), "best_pass_seconds": best,
+              "ops_per_sec": len(items) / best if best else 0.0}
+    result.update(latency_stats(durations))
+    result["start_rss_mb"] = start_rss
+    result["peak_rss_mb"] = peak_rss
+    return result
+
+def run_suite(paths, names=None):
+    """Runs each case in a fresh spawned process (so peak RSS is that case's alone)."""
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    for name in names or CASES:
+        with context.Pool(processes=1) as pool:
+            try:
+                results[name] = pool.apply(run_case, (name, paths))
+            except Exception as e:
+                results[name] = {"error": f"{type(e).__name__}: {e}"}
+        print_result(name, results[name])
+    return results
+
+def print_result(name, r):
+    if "error" in r:
+        print(f"  {name:<30} failed: {r['error']}")
+        return
+    rss = f"{r['peak_rss_mb']:7.1f} MB" if r.get("peak_rss_mb") is not None else "      n/a"
+    if r.get("start_rss_mb") is not None:
+        rss += f" (from {r['start_rss_mb']:.1f})"
+    print(f"  {name:<30} {r['ops_per_sec']:10.1f} ops/sec ({r['unit']})  p50 {r['p50_ms']:8.3f}  p95 {r['p95_ms']:8.3f}  "
+          f"p99 {r['p99_ms']:8.3f}  max {r['max_ms']:8.3f} ms  peak RSS {rss}")
+
+def compare_results(baseline, current, threshold=REGRESSION_THRESHOLD):
+    """Returns a list of (case, metric, baseline value, current value) regressions."""
+    regressions = []
+    for name, r in current["cases"].items():
+        base = baseline.get("cases", {}).get(name)
+        if not base or "error" in base or "error" in r:
+            continue
+        if r["ops_per_sec"] < base["ops_per_sec"] * (1 - threshold):
+            regressions.append((name, "ops_per_sec", base["ops_per_sec"], r["ops_per_sec"]))
+        if r["p95_ms"] > base["p95_ms"] * (1 + threshold):
+            regressions.append((name, "p95_ms", base["p95_ms"], r["p95_ms"]))
+    return regressions
+
+def suite_main(args):
+    if not args:
+        print("Usage: python bench.py suite <folder> [results.json] [baseline.json] [threshold, e.g. 0.1]")
+        sys.exit(2)
+    folder = args[0]
+    results_file = args[1] if len(args) > 1 else RESULTS_FILE
+    baseline_file = args[2] if len(args) > 2 else None
+    threshold = float(args[3]) if len(args) > 3 else REGRESSION_THRESHOLD
+    paths = sorted(os.path.abspath(p) for p in glob.glob(os.path.join(folder, "**", "*.rep"), recursive=True))
+    if not paths:
+        print("No .rep files found.")
+        sys.exit(2)
+    print(f"Benchmark suite over {len(paths)} replays:")
+    current = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(), "platform": platform.platform(),
+        "folder": os.path.abspath(folder), "replays": len(paths),
+        "cases": run_suite(paths)
+    }
+    with open(results_file, "w", encoding="utf-8") as f:
+        json.dump(current, f, indent=1)
+    print(f"Results written to {results_file}")
+    if baseline_file is None:
+        return
+    with open(baseline_file, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare_results(baseline, current, threshold)
+    for name, metric, before, after in regressions:
+        print(f"  REGRESSION {name} {metric}: {before:.3f} -> {after:.3f} ({(after / before - 1) * 100:+.1f}%)")
+    print(f"Compared against {baseline_file}: {len(regressions)} regressions over {threshold * 100:.0f}%")
+    sys.exit(1 if regressions else 0)
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "suite":
+        suite_main(sys.argv[2:])
+        return
+    root = sys.argv[1] if len(sys.argv) > 1 else "."
+    paths = sorted(glob.glob(f"{root}/**/*.rep", recursive=True))
+    if not paths:
+        print("No .rep files found.")
+        return
+    bench_reader(paths)
+    bench_columnar(paths)
+
+if __name__ == "__main__":
+    main()
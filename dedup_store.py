@@ -0,0 +1,78 @@
+import time
+import sqlite3
+
+class DedupStore:
+    """
+    Keeps the longest replay per match key for a SQLite table.
+
+    Every row of the table is held in memory, so duplicate checks never touch
+    the database. New winners are buffered and written with one executemany
+    upsert per batch inside a single transaction; the upsert only overwrites a
+    stored row when the incoming duration is longer.
+    """
+
+    def __init__(self, db_file, table, columns, key_column, duration_column, batch_size=2000):
+        self.table = table
+        self.columns = list(columns)
+        self.key_index = self.columns.index(key_column)
+        self.duration_index = self.columns.index(duration_column)
+        self.batch_size = batch_size
+        self.conn = sqlite3.connect(db_file)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=OFF")
+        updates = ", ".join(f"{c} = excluded.{c}" for c in self.columns if c != key_column)
+        self.upsert_sql = (
+            f"INSERT INTO {table} ({', '.join(self.columns)}) VALUES ({', '.join('?' for _ in self.columns)}) "
+            f"ON CONFLICT({key_column}) DO UPDATE SET {updates} "
+            f"WHERE excluded.{duration_column} > {table}.{duration_column}"
+        )
+        self.best = {row[self.key_index]: row for row in self.conn.execute(f"SELECT {', '.join(self.columns)} FROM {table}")}
+        self.pending = {}
+        self.flush_times = []
+        self.rows_flushed = 0
+
+    def check(self, key, duration):
+        """Returns (is_longer, stored_row); stored_row is None for a key not seen before."""
+        row = self.best.get(key)
+        if row is None:
+            return True, None
+        return duration > row[self.duration_index], row
+
+    def put(self, row):
+        row = tuple(row)
+        self.best[row[self.key_index]] = row
+        self.pending[row[self.key_index]] = row
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        start = time.perf_counter()
+        with self.conn:
+            self.conn.executemany(self.upsert_sql, list(self.pending.values()))
+        self.flush_times.append(time.perf_counter() - start)
+        self.rows_flushed += len(self.pending)
+        self.pending.clear()
+
+    def rows(self):
+        return list(self.best.values())
+
+    def stats(self):
+        total = sum(self.flush_times)
+        return {
+            "flushes": len(self.flush_times),
+            "rows_flushed": self.rows_flushed,
+            "total_flush_seconds": total,
+            "avg_flush_ms": (total / len(self.flush_times) * 1000) if self.flush_times else 0.0,
+            "max_flush_ms": max(self.flush_times) * 1000 if self.flush_times else 0.0
+        }
+
+    def report(self):
+        s = self.stats()
+        return (f"{s['rows_flushed']} rows in {s['flushes']} flushes, "
+                f"{s['total_flush_seconds']:.3f}s total (avg {s['avg_flush_ms']:.2f} ms, max {s['max_flush_ms']:.2f} ms)")
+
+    def close(self):
+        self.flush()
+        self.conn.close()
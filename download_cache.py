@@ -0,0 +1,159 @@
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+
+CACHE_DIR = "download_cache"
+CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+class DownloadCache:
+    """
+    On-disk cache of downloaded replays. Bodies are stored once per content
+    hash (blobs/ab/<sha1>), so URLs serving the same file share a blob; an
+    SQLite table maps each URL to its blob plus the ETag / Last-Modified the
+    server sent, which the fetcher sends back as a conditional request.
+
+    Total blob size is kept under max_bytes by evicting the least recently
+    used URLs; a blob is deleted once no URL points at it. With max_age set,
+    entries validated less than max_age seconds ago are served without a
+    request at all. Safe to share between threads.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES, max_age=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        os.makedirs(os.path.join(cache_dir, "blobs"), exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(cache_dir, "index.db"), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS urls (
+                url TEXT PRIMARY KEY,
+                sha1 TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                validated_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS urls_sha1 ON urls (sha1)")
+        self.lock = threading.RLock()
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT sha1, size FROM urls)").fetchone()[0]
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    def _blob_path(self, digest):
+        return os.path.join(self.cache_dir, "blobs", digest[:2], digest)
+
+    def lookup(self, url):
+        """Returns the entry dict for url, or None when it is not cached."""
+        with self.lock:
+            row = self.conn.execute("SELECT sha1, size, etag, last_modified, validated_at FROM urls WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        return {"sha1": row[0], "size": row[1], "etag": row[2], "last_modified": row[3], "validated_at": row[4]}
+
+    def is_fresh(self, entry):
+        return self.max_age is not None and time.time() - entry["validated_at"] < self.max_age
+
+    def validators(self, entry):
+        """Conditional request headers for a cached entry."""
+        headers = {}
+        if entry.get("etag"): headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"): headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def read(self, url, entry, revalidated=False):
+        """Returns the cached body, or None (and drops the entry) when the blob is missing or corrupt."""
+        try:
+            with open(self._blob_path(entry["sha1"]), "rb") as f:
+                content = f.read()
+        except OSError:
+            content = None
+        if content is None or hashlib.sha1(content).hexdigest() != entry["sha1"]:
+            self.forget(url)
+            return None
+        now = time.time()
+        with self.lock:
+            with self.conn:
+                if revalidated:
+                    self.conn.execute("UPDATE urls SET validated_at = ?, last_access = ? WHERE url = ?", (now, now, url))
+                else:
+                    self.conn.execute("UPDATE urls SET last_access = ? WHERE url = ?", (now, url))
+            self.hits += 1
+            self.revalidated += revalidated
+            self.bytes_saved += len(content)
+        return content
+
+    def store(self, url, content, etag=None, last_modified=None):
+        digest = hashlib.sha1(content).hexdigest()
+        path = self._blob_path(digest)
+        now = time.time()
+        with self.lock:
+            self.misses += 1
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(content)
+                os.replace(tmp_path, path)
+                self.total_bytes += len(content)
+            old = self.conn.execute("SELECT sha1 FROM urls WHERE url = ?", (url,)).fetchone()
+            with self.conn:
+                self.conn.execute("INSERT OR REPLACE INTO urls VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                  (url, digest, len(content), etag, last_modified, now, now))
+            if old and old[0] != digest:
+                self._release_blob(old[0])
+            self.evict()
+
+    def _release_blob(self, digest):
+        """Deletes a blob no URL points at any more."""
+        if self.conn.execute("SELECT 1 FROM urls WHERE sha1 = ? LIMIT 1", (digest,)).fetchone():
+            return
+        path = self._blob_path(digest)
+        try:
+            self.total_bytes -= os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            pass
+
+    def forget(self, url):
+        with self.lock:
+            row = self.conn.execute("SELECT sha1 FROM urls WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                return
+            with self.conn:
+                self.conn.execute("DELETE FROM urls WHERE url = ?", (url,))
+            self._release_blob(row[0])
+
+    def evict(self):
+        """Drops least recently used URLs until the blobs fit in max_bytes."""
+        with self.lock:
+            while self.total_bytes > self.max_bytes:
+                row = self.conn.execute("SELECT url FROM urls ORDER BY last_access LIMIT 1").fetchone()
+                if row is None:
+                    break
+                self.forget(row[0])
+
+    def stats(self):
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM urls").fetchone()[0]
+            requests = self.hits + self.misses
+            return {'hits': self.hits, 'revalidated': self.revalidated, 'misses': self.misses,
+                    'hit_ratio': self.hits / requests if requests else 0.0, 'bytes_saved': self.bytes_saved,
+                    'entries': entries, 'bytes': self.total_bytes, 'max_bytes': self.max_bytes}
+
+    def report(self):
+        s = self.stats()
+        return (f"{s['hits']} from cache ({s['revalidated']} revalidated), {s['misses']} downloaded "
+                f"({s['hit_ratio'] * 100:.1f}% hits, {s['bytes_saved'] / 1e6:.1f} MB saved); "
+                f"{s['entries']} entries, {s['bytes'] / 1e6:.1f}/{s['max_bytes'] / 1e6:.0f} MB")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
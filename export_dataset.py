@@ -0,0 +1,268 @@
+import os
+import sys
+import glob
+import json
+import time
+from datetime import datetime, timezone
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+import replay_columns
+import zstd_dict
+
+# ----------------------------
+# Dataset Layout
+# ----------------------------
+# <root>/replays/   one row per replay (header fields)
+# <root>/players/   one row per player_info entry
+# <root>/messages/  one row per message (frame, type, player)
+#
+# Every table carries replay_id plus the map/month partition columns, so
+# filters on map or month prune whole directories before any file is opened.
+#
+# A replay is exported again when its parsed file's mtime no longer matches
+# source_mtime (parse.py replaced a shorter duplicate under the same name):
+# its old rows are dropped from every table before the new ones are written.
+DATASET_DIR = "dataset"
+TABLES = ("replays", "players", "messages")
+PARTITION_COLUMNS = ["map", "month"]
+BATCH_SIZE = 500
+
+def require_pyarrow():
+    if not PYARROW_AVAILABLE:
+        raise ImportError("pyarrow is required for dataset export. Install it using: pip install pyarrow")
+
+def replay_month(start_time):
+    try:
+        return datetime.fromtimestamp(start_time, timezone.utc).strftime("%Y-%m")
+    except (OverflowError, OSError, ValueError, TypeError):
+        return "unknown"
+
+def replay_id_for(path):
+    name = os.path.basename(path)
+    for ext in (".json.zst", replay_columns.EXTENSION):
+        if name.endswith(ext):
+            return name[:-len(ext)]
+    return os.path.splitext(name)[0]
+
+def load_parsed_file(path):
+    """Returns (header, player_info, frame list, type list, player list) for .rcol or .json.zst."""
+    if path.endswith(replay_columns.EXTENSION):
+        replay = replay_columns.read_replay(path, columns=("frame", "type", "player"))
+        columns = replay["columns"]
+        return (replay["header"], replay["player_info"],
+                columns["frame"].tolist(), columns["type"].tolist(), columns["player"].tolist())
+    with open(path, "rb") as f:
+        data = json.loads(zstd_dict.decompress(f.read(), os.path.dirname(path)))
+    messages = data.get("messages", [])
+    return (data.get("header", {}), data.get("player_info", []),
+            [m.get("frame") for m in messages], [m.get("type") for m in messages], [m.get("player_index") for m in messages])
+
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        return None
+
+# ----------------------------
+# Export
+# ----------------------------
+REPLAY_SCHEMA_FIELDS = [
+    ("replay_id", "string"), ("map", "string"), ("month", "string"), ("start_time", "int64"), ("end_time", "int64"),
+    ("frame_duration", "int64"), ("desync_game", "int8"), ("quit_early", "int8"), ("version_string", "string"),
+    ("local_player_index", "int16"), ("game_options", "string"), ("source_file", "string"), ("source_mtime", "int64")
+]
+PLAYER_SCHEMA_FIELDS = [
+    ("replay_id", "string"), ("map", "string"), ("month", "string"), ("slot", "int16"), ("player_index", "int16"),
+    ("type", "string"), ("name", "string"), ("template", "string"), ("template_index", "int16"),
+    ("color", "string"), ("color_index", "int16"), ("team", "int16"), ("position", "int16"),
+    ("original_color", "int16"), ("original_template", "int16")
+]
+MESSAGE_SCHEMA_FIELDS = [
+    ("replay_id", "string"), ("map", "string"), ("month", "string"),
+    ("frame", "uint32"), ("type", "int16"), ("player", "int8")
+]
+
+TABLE_FIELDS = {"replays": REPLAY_SCHEMA_FIELDS, "players": PLAYER_SCHEMA_FIELDS, "messages": MESSAGE_SCHEMA_FIELDS}
+
+def _schema(fields):
+    return pa.schema([(name, pa.type_for_alias(type_name)) for name, type_name in fields])
+
+def _empty_columns(fields):
+    return {name: [] for name, _ in fields}
+
+def existing_replays(root=DATASET_DIR):
+    """{replay_id: (source_mtime, map, month)} for the replays already exported."""
+    path = os.path.join(root, "replays")
+    if not os.path.isdir(path):
+        return {}
+    table = open_dataset(root, "replays").to_table(columns=["replay_id", "source_mtime", "map", "month"])
+    return {replay_id: (mtime, map_name, month) for replay_id, mtime, map_name, month in
+            zip(*(table.column(c).to_pylist() for c in ("replay_id", "source_mtime", "map", "month")))}
+
+def remove_replays(root, partitions):
+    """Drops the rows of {replay_id: (map, month)} from every table, rewriting only the files that held them."""
+    ids = pa.array(sorted(partitions), type=pa.string())
+    for table_name in TABLES:
+        if not os.path.isdir(os.path.join(root, table_name)):
+            continue
+        dataset = open_dataset(root, table_name)
+        for map_name, month in set(partitions.values()):
+            for fragment in dataset.get_fragments(filter=(ds.field("map") == map_name) & (ds.field("month") == month)):
+                table = pq.read_table(fragment.path, partitioning=None)
+                keep = pc.invert(pc.is_in(table.column("replay_id"), value_set=ids))
+                kept = table.filter(keep)
+                if kept.num_rows == table.num_rows:
+                    continue
+                if kept.num_rows:
+                    pq.write_table(kept, fragment.path)
+                else:
+                    os.remove(fragment.path)
+
+def _write_batch(root, batch, replaced, run_tag, batch_no):
+    if replaced:
+        remove_replays(root, replaced)
+    for table_name, fields in (("replays", REPLAY_SCHEMA_FIELDS), ("players", PLAYER_SCHEMA_FIELDS), ("messages", MESSAGE_SCHEMA_FIELDS)):
+        columns = batch[table_name]
+        if not columns["replay_id"]:
+            continue
+        table = pa.Table.from_pydict(columns, schema=_schema(fields))
+        ds.write_dataset(
+            table, os.path.join(root, table_name), format="parquet",
+            partitioning=PARTITION_COLUMNS, partitioning_flavor="hive",
+            basename_template=f"part-{run_tag}-{batch_no}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore"
+        )
+
+def export_parsed_files(paths, root=DATASET_DIR, batch_size=BATCH_SIZE):
+    """Appends new parsed replays to the dataset and replaces those whose file changed. Returns the count written."""
+    require_pyarrow()
+    known = existing_replays(root)
+    run_tag = f"{int(time.time())}-{os.getpid()}"
+    batch = {name: _empty_columns(fields) for name, fields in
+             (("replays", REPLAY_SCHEMA_FIELDS), ("players", PLAYER_SCHEMA_FIELDS), ("messages", MESSAGE_SCHEMA_FIELDS))}
+    replaced = {}
+    in_batch = 0; batch_no = 0; added = 0
+    for path in paths:
+        replay_id = replay_id_for(path)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError as e:
+            print(f"Error reading {path}: {e}")
+            continue
+        stored = known.get(replay_id)
+        if stored is not None and stored[0] == mtime:
+            continue
+        try:
+            header, player_info, frames, types, players = load_parsed_file(path)
+        except Exception as e:
+            print(f"Error reading {path}: {e}")
+            continue
+        map_name = header.get("map", "") or "unknown"
+        month = replay_month(header.get("start_time"))
+        if stored is not None:
+            replaced[replay_id] = stored[1:]
+        known[replay_id] = (mtime, map_name, month)
+        replays = batch["replays"]
+        for name, value in (("replay_id", replay_id), ("map", map_name), ("month", month),
+                            ("start_time", header.get("start_time")), ("end_time", header.get("end_time")),
+                            ("frame_duration", header.get("frame_duration")), ("desync_game", header.get("desync_game")),
+                            ("quit_early", header.get("quit_early")), ("version_string", header.get("version_string")),
+                            ("local_player_index", _int_or_none(header.get("Local_Player_Index"))),
+                            ("game_options", header.get("game_options")), ("source_file", path), ("source_mtime", mtime)):
+            replays[name].append(value)
+        player_rows = batch["players"]
+        for p in player_info:
+            for name, value in (("replay_id", replay_id), ("map", map_name), ("month", month), ("slot", p.get("slot")),
+                                ("player_index", p.get("PlayerIndex")), ("type", p.get("Type")), ("name", p.get("Name")),
+                                ("template", p.get("template")), ("template_index", p.get("template_index")),
+                                ("color", p.get("color")), ("color_index", p.get("color_index")),
+                                ("team", _int_or_none(p.get("Team"))), ("position", _int_or_none(p.get("Position"))),
+                                ("original_color", p.get("original_color")), ("original_template", p.get("original_template"))):
+                player_rows[name].append(value)
+        message_rows = batch["messages"]
+        message_rows["replay_id"].extend([replay_id] * len(frames))
+        message_rows["map"].extend([map_name] * len(frames))
+        message_rows["month"].extend([month] * len(frames))
+        message_rows["frame"].extend(frames)
+        message_rows["type"].extend(types)
+        message_rows["player"].extend(players)
+        in_batch += 1; added += 1
+        if in_batch >= batch_size:
+            _write_batch(root, batch, replaced, run_tag, batch_no)
+            batch = {name: _empty_columns(fields) for name, fields in
+                     (("replays", REPLAY_SCHEMA_FIELDS), ("players", PLAYER_SCHEMA_FIELDS), ("messages", MESSAGE_SCHEMA_FIELDS))}
+            replaced = {}
+            in_batch = 0; batch_no += 1
+    if in_batch:
+        _write_batch(root, batch, replaced, run_tag, batch_no)
+    return added
+
+def export_parsed_folder(folder="parsed", root=DATASET_DIR):
+    paths = sorted(glob.glob(os.path.join(folder, "*.json.zst")) + glob.glob(os.path.join(folder, "*" + replay_columns.EXTENSION)))
+    return export_parsed_files(paths, root)
+
+# ----------------------------
+# Reader Helpers
+# ----------------------------
+def open_dataset(root=DATASET_DIR, table="replays"):
+    require_pyarrow()
+    if table not in TABLES:
+        raise ValueError(f"Unknown dataset table: {table}")
+    # The explicit schema lets files written before a column was added read it as null
+    return ds.dataset(os.path.join(root, table), format="parquet", partitioning="hive", schema=_schema(TABLE_FIELDS[table]))
+
+def load_table(root=DATASET_DIR, table="replays", filter=None, columns=None):
+    """Scans one table; filter is a pyarrow.dataset expression, e.g. ds.field("map") == "Tournament Desert"."""
+    return open_dataset(root, table).to_table(filter=filter, columns=columns)
+
+def iter_replay_data(root=DATASET_DIR, filter=None):
+    """
+    Yields replays matching filter (an expression over the replays table) in the
+    {"header", "player_info", "messages"} shape that check_winner.py works on.
+    Message args are not part of the dataset.
+    """
+    replays = load_table(root, "replays", filter=filter).to_pylist()
+    if not replays:
+        return
+    ids = [r["replay_id"] for r in replays]
+    id_filter = ds.field("replay_id").isin(ids)
+    if filter is not None:
+        id_filter = id_filter & filter
+    players_by_replay = {}
+    for p in load_table(root, "players", filter=id_filter).to_pylist():
+        players_by_replay.setdefault(p["replay_id"], []).append({
+            "slot": p["slot"], "PlayerIndex": p["player_index"], "Type": p["type"], "Name": p["name"],
+            "template": p["template"], "template_index": p["template_index"], "color": p["color"],
+            "color_index": p["color_index"], "Team": p["team"], "Position": p["position"],
+            "original_color": p["original_color"], "original_template": p["original_template"]
+        })
+    messages_by_replay = {}
+    message_table = load_table(root, "messages", filter=id_filter, columns=["replay_id", "frame", "type", "player"])
+    for replay_id, frame, msg_type, player in zip(*(message_table.column(c).to_pylist() for c in ("replay_id", "frame", "type", "player"))):
+        messages_by_replay.setdefault(replay_id, []).append({"frame": frame, "type": msg_type, "player_index": player})
+    for r in replays:
+        header = {k: v for k, v in r.items() if k not in ("replay_id", "source_file", "source_mtime", "local_player_index")}
+        header["Local_Player_Index"] = r["local_player_index"]
+        yield {
+            "replay_id": r["replay_id"],
+            "header": header,
+            "player_info": players_by_replay.get(r["replay_id"], []),
+            "messages": sorted(messages_by_replay.get(r["replay_id"], []), key=lambda m: m["frame"])
+        }
+
+def main():
+    folder = sys.argv[1] if len(sys.argv) > 1 else "parsed"
+    root = sys.argv[2] if len(sys.argv) > 2 else DATASET_DIR
+    added = export_parsed_folder(folder, root)
+    print(f"Added {added} replays to dataset {root}")
+
+if __name__ == "__main__":
+    main()
@@ -3,9 +3,18 @@ import struct
 import json
 import glob
 import random
-import time
 import sqlite3
-import zstandard as zstd
+from multiprocessing import Pool, cpu_count
+from multiprocessing.pool import ThreadPool
+import zstd_dict
+import replay_columns
+from dedup_store import DedupStore
+from prng import AssignmentCache, RandomGenerator
+from replay_index import ReplayIndex, INDEX_FILE
+from stage_timing import StageTimings, new_laps, timed_results, worker_id, print_summary, NO_LAPS
+from replay_filters import probe_replay, version_filter, min_duration_filter
+from replay_summary import build_player_index, build_player_index_from_columns, summarize, make_sidecar, write_sidecar, remove_sidecar
+from replay_reader import MAX_SLOTS, ARG_TYPE_MAP, MESSAGE_TYPE_MAP, parse_rep_file
 
 # ----------------------------
 # Global Valid Versions
@@ -13,62 +22,70 @@ import zstandard as zstd
 VALID_VERSIONS = {"Version 1.04", "버전 1.04", "版本 1.04", "Версия 1.04", "Versión 1.04", "Versione 1.04"}
 
 # ----------------------------
-# Custom RNG Replication (C++ ADC-based)
+# Header Filters
 # ----------------------------
-GAME_LOGIC_SEED = [
-    0xf22d0e56, 0x883126e9, 0xc624dd2f,
-    0x702c49c, 0x9e353f7d, 0x6fdf3b64
-]
-
-def seed_random(seed, seed_array):
-    seed_array[0] = (seed + 0xf22d0e56) & 0xFFFFFFFF
-    seed_array[1] = (seed_array[0] + (0x883126e9 - 0xf22d0e56)) & 0xFFFFFFFF
-    seed_array[2] = (seed_array[1] + (0xc624dd2f - 0x883126e9)) & 0xFFFFFFFF
-    seed_array[3] = (seed_array[2] + (0x0702c49c - 0xc624dd2f)) & 0xFFFFFFFF
-    seed_array[4] = (seed_array[3] + (0x9e353f7d - 0x0702c49c)) & 0xFFFFFFFF
-    seed_array[5] = (seed_array[4] + (0x6fdf3b64 - 0x9e353f7d)) & 0xFFFFFFFF
-
-def init_random(seed):
-    global GAME_LOGIC_SEED
-    seed_random(seed, GAME_LOGIC_SEED)
-
-def adc(a, b, carry):
-    s = a + b + carry
-    sum_val = s & 0xFFFFFFFF
-    new_carry = s >> 32
-    return sum_val, new_carry
-
-def random_value(seed_array):
-    carry = 0
-    ax, carry = adc(seed_array[5], seed_array[4], carry)
-    seed_array[4] = ax
-    ax, carry = adc(ax, seed_array[3], carry)
-    seed_array[3] = ax
-    ax, carry = adc(ax, seed_array[2], carry)
-    seed_array[2] = ax
-    ax, carry = adc(ax, seed_array[1], carry)
-    seed_array[1] = ax
-    ax, carry = adc(ax, seed_array[0], carry)
-    seed_array[0] = ax
-    seed_array[5] = (seed_array[5] + 1) & 0xFFFFFFFF
-    if seed_array[5] == 0:
-        seed_array[4] = (seed_array[4] + 1) & 0xFFFFFFFF
-        if seed_array[4] == 0:
-            seed_array[3] = (seed_array[3] + 1) & 0xFFFFFFFF
-            if seed_array[3] == 0:
-                seed_array[2] = (seed_array[2] + 1) & 0xFFFFFFFF
-                if seed_array[2] == 0:
-                    seed_array[1] = (seed_array[1] + 1) & 0xFFFFFFFF
-                    if seed_array[1] == 0:
-                        seed_array[0] = (seed_array[0] + 1) & 0xFFFFFFFF
-                        ax = (ax + 1) & 0xFFFFFFFF
-    return ax
-
-def get_game_logic_random_value(lo, hi):
-    delta = hi - lo + 1
-    if delta == 0:
-        return hi
-    return (random_value(GAME_LOGIC_SEED) % delta) + lo
+# Checked on a header-only probe before the replay is parsed; the first filter
+# that rejects a replay names its skip status. replay_filters.py also has
+# match_type_filter, no_ai_filter and map_filter.
+MIN_FRAME_DURATION = 600
+REPLAY_FILTERS = [version_filter(VALID_VERSIONS), min_duration_filter(MIN_FRAME_DURATION)]
+
+# ----------------------------
+# Output Format
+# ----------------------------
+# "columnar" writes .rcol files (see replay_columns.py, needs numpy);
+# "json" writes the original indented .json.zst files.
+OUTPUT_FORMAT = "columnar"
+
+# Compress outputs with the newest shared dictionary in parsed/ (trained with
+# `python zstd_dict.py parsed`); without one, files are compressed on their own.
+USE_ZSTD_DICTIONARY = True
+
+# Append every kept replay to the partitioned Parquet dataset (see
+# export_dataset.py, needs pyarrow) once all files are processed.
+EXPORT_DATASET = False
+
+# ----------------------------
+# Parallel Parsing
+# ----------------------------
+# Worker processes for parse_worker; 1 parses in the main process.
+WORKERS = max(1, cpu_count() - 1)
+CHUNK_SIZE = 16
+# Run the workers as threads of this process instead. Every replay gets its own
+# RandomGenerator, so threads share no PRNG state; results skip pickling.
+USE_THREADS = False
+
+# ----------------------------
+# Incremental Runs
+# ----------------------------
+# Keep duplicates.db and a replay_index.db between runs and skip replays whose
+# path, size and mtime are unchanged since they were last processed. Only
+# enable this while the parsed folder is kept between runs too.
+INCREMENTAL = False
+
+# ----------------------------
+# Random Assignment Cache
+# ----------------------------
+# Resolved random templates/colors keyed by seed and slot pattern, so
+# duplicate POVs of one match skip the generator. Set ASSIGNMENT_CACHE_FILE to
+# a path to keep them between runs.
+ASSIGNMENT_CACHE_FILE = None
+RANDOM_ASSIGNMENTS = AssignmentCache()
+
+# ----------------------------
+# Stage Timing
+# ----------------------------
+# Time every replay's stages (header probe, parse, slots, PRNG, record
+# assembly, summary and compression in the workers; dedup DB and write in
+# main) and write histograms plus the slowest replays to STAGE_TIMINGS_FILE
+# (stage_timing.py).
+TIME_STAGES = False
+STAGE_TIMINGS_FILE = "parse_stage_timings.json"
+
+def load_assignment_cache(path=None):
+    path = path or ASSIGNMENT_CACHE_FILE
+    if path:
+        RANDOM_ASSIGNMENTS.load(path)
 
 # ----------------------------
 # Template and Color Setup
@@ -103,123 +120,6 @@ AVAILABLE_COLORS = {
 # ----------------------------
 # Replay File Parsing
 # ----------------------------
-MAX_SLOTS = 8
-
-ARG_TYPE_MAP = {
-    0: ('i', 4),
-    1: ('f', 4),
-    2: ('?', 1),
-    3: ('I', 4),
-    4: ('I', 4),
-    5: ('I', 4),
-    6: ('fff', 12),
-    7: ('ii', 8),
-    8: ('iiii', 16),
-    9: ('I', 4),
-    10: ('H', 2),
-}
-
-MESSAGE_TYPE_MAP = {
-    1000: "MSG_BEGIN_NETWORK_MESSAGES",
-    1001: "MSG_CREATE_SELECTED_GROUP",
-    1002: "MSG_CREATE_SELECTED_GROUP_NO_SOUND",
-    1003: "MSG_DESTROY_SELECTED_GROUP",
-    1004: "MSG_REMOVE_FROM_SELECTED_GROUP",
-    1005: "MSG_SELECTED_GROUP_COMMAND",
-    1006: "MSG_CREATE_TEAM0",
-    1007: "MSG_CREATE_TEAM1",
-    1008: "MSG_CREATE_TEAM2",
-    1009: "MSG_CREATE_TEAM3",
-    1010: "MSG_CREATE_TEAM4",
-    1011: "MSG_CREATE_TEAM5",
-    1012: "MSG_CREATE_TEAM6",
-    1013: "MSG_CREATE_TEAM7",
-    1014: "MSG_CREATE_TEAM8",
-    1015: "MSG_CREATE_TEAM9",
-    1016: "MSG_SELECT_TEAM0",
-    1017: "MSG_SELECT_TEAM1",
-    1018: "MSG_SELECT_TEAM2",
-    1019: "MSG_SELECT_TEAM3",
-    1020: "MSG_SELECT_TEAM4",
-    1021: "MSG_SELECT_TEAM5",
-    1022: "MSG_SELECT_TEAM6",
-    1023: "MSG_SELECT_TEAM7",
-    1024: "MSG_SELECT_TEAM8",
-    1025: "MSG_SELECT_TEAM9",
-    1026: "MSG_ADD_TEAM0",
-    1027: "MSG_ADD_TEAM1",
-    1028: "MSG_ADD_TEAM2",
-    1029: "MSG_ADD_TEAM3",
-    1030: "MSG_ADD_TEAM4",
-    1031: "MSG_ADD_TEAM5",
-    1032: "MSG_ADD_TEAM6",
-    1033: "MSG_ADD_TEAM7",
-    1034: "MSG_ADD_TEAM8",
-    1035: "MSG_ADD_TEAM9",
-    1036: "MSG_DO_ATTACKSQUAD",
-    1037: "MSG_DO_WEAPON",
-    1038: "MSG_DO_WEAPON_AT_LOCATION",
-    1039: "MSG_DO_WEAPON_AT_OBJECT",
-    1040: "MSG_DO_SPECIAL_POWER",
-    1041: "MSG_DO_SPECIAL_POWER_AT_LOCATION",
-    1042: "MSG_DO_SPECIAL_POWER_AT_OBJECT",
-    1043: "MSG_SET_RALLY_POINT",
-    1044: "MSG_PURCHASE_SCIENCE",
-    1045: "MSG_QUEUE_UPGRADE",
-    1046: "MSG_CANCEL_UPGRADE",
-    1047: "MSG_QUEUE_UNIT_CREATE",
-    1048: "MSG_CANCEL_UNIT_CREATE",
-    1049: "MSG_DOZER_CONSTRUCT",
-    1050: "MSG_DOZER_CONSTRUCT_LINE",
-    1051: "MSG_DOZER_CANCEL_CONSTRUCT",
-    1052: "MSG_SELL",
-    1053: "MSG_EXIT",
-    1054: "MSG_EVACUATE",
-    1055: "MSG_EXECUTE_RAILED_TRANSPORT",
-    1056: "MSG_COMBATDROP_AT_LOCATION",
-    1057: "MSG_COMBATDROP_AT_OBJECT",
-    1058: "MSG_AREA_SELECTION",
-    1059: "MSG_DO_ATTACK_OBJECT",
-    1060: "MSG_DO_FORCE_ATTACK_OBJECT",
-    1061: "MSG_DO_FORCE_ATTACK_GROUND",
-    1062: "MSG_GET_REPAIRED",
-    1063: "MSG_GET_HEALED",
-    1064: "MSG_DO_REPAIR",
-    1065: "MSG_RESUME_CONSTRUCTION",
-    1066: "MSG_ENTER",
-    1067: "MSG_DOCK",
-    1068: "MSG_DO_MOVETO",
-    1069: "MSG_DO_ATTACKMOVETO",
-    1070: "MSG_DO_FORCEMOVETO",
-    1071: "MSG_ADD_WAYPOINT",
-    1072: "MSG_DO_GUARD_POSITION",
-    1073: "MSG_DO_GUARD_OBJECT",
-    1074: "MSG_DO_STOP",
-    1075: "MSG_DO_SCATTER",
-    1076: "MSG_INTERNET_HACK",
-    1077: "MSG_DO_CHEER",
-    1078: "MSG_TOGGLE_OVERCHARGE",
-    1079: "MSG_SWITCH_WEAPONS",
-    1080: "MSG_CONVERT_TO_CARBOMB",
-    1081: "MSG_CAPTUREBUILDING",
-    1082: "MSG_DISABLEVEHICLE_HACK",
-    1083: "MSG_STEALCASH_HACK",
-    1084: "MSG_DISABLEBUILDING_HACK",
-    1085: "MSG_SNIPE_VEHICLE",
-    1086: "MSG_DO_SPECIAL_POWER_OVERRIDE_DESTINATION",
-    1087: "MSG_DO_SALVAGE",
-    1088: "MSG_CLEAR_INGAME_POPUP_MESSAGE",
-    1089: "MSG_PLACE_BEACON",
-    1090: "MSG_REMOVE_BEACON",
-    1091: "MSG_SET_BEACON_TEXT",
-    1092: "MSG_SET_REPLAY_CAMERA",
-    1093: "MSG_SELF_DESTRUCT",
-    1094: "MSG_CREATE_FORMATION",
-    1095: "MSG_LOGIC_CRC",
-    1096: "MSG_SET_MINE_CLEARING_DETAIL",
-    1097: "MSG_ENABLE_RETALIATION_MODE",
-}
-
 def read_ascii_string(file):
     bytes_read = bytearray()
     while True:
@@ -275,7 +175,9 @@ def parse_game_message(f):
         "args": args
     }
 
-def parse_rep_file(file_path):
+# Original stream-based reader, kept as the reference implementation for
+# bench.py. parse_rep_file (replay_reader) decodes the same layout from memory.
+def parse_rep_file_stream(file_path):
     with open(file_path, 'rb') as f:
         file_size = os.fstat(f.fileno()).st_size
         identifier = f.read(6).decode('ascii')
@@ -454,58 +356,66 @@ def extract_seed_from_options(game_options):
                 return None
     return None
 
-def assign_random_template_and_color(player_info, available_templates, available_colors, seed_value=None):
+def resolve_random_template_and_color(generator, slots, seed_value, available_templates, available_colors):
+    """Runs the game PRNG over the (Template, Color) strings of the eligible players in order; returns [template_index, color_index] per player."""
     valid_templates = [i for i in available_templates.keys() if 2 <= i <= 13]
     taken_colors = set()
+    resolved = []
+    for tpl_val, col_val in slots:
+        if tpl_val == "-1":
+            generator.discard(seed_value % 7)
+            idx = generator.get_value(0, 1000) % len(valid_templates)
+            template_index = valid_templates[idx]
+        elif tpl_val == "-2":
+            template_index = 1
+        else:
+            try:
+                template_index = int(tpl_val)
+                if template_index not in available_templates:
+                    generator.discard(seed_value % 7)
+                    idx = generator.get_value(0, 1000) % len(valid_templates)
+                    template_index = valid_templates[idx]
+            except ValueError:
+                generator.discard(seed_value % 7)
+                idx = generator.get_value(0, 1000) % len(valid_templates)
+                template_index = valid_templates[idx]
+        if col_val == "-1":
+            color_index = generator.get_value(0, len(available_colors)-1)
+            while color_index in taken_colors:
+                color_index = generator.get_value(0, len(available_colors)-1)
+        else:
+            try:
+                color_index = int(col_val)
+                if color_index not in available_colors:
+                    color_index = generator.get_value(0, len(available_colors)-1)
+            except ValueError:
+                color_index = generator.get_value(0, len(available_colors)-1)
+        taken_colors.add(color_index)
+        resolved.append([template_index, color_index])
+    return resolved
+
+def is_playing_slot(player):
+    return player["Type"] in ("Human",) or player["Type"].startswith("AI")
+
+def assign_random_template_and_color(player_info, available_templates, available_colors, seed_value=None):
+    """Resolves random templates/colors with a generator of its own, so concurrent calls never share PRNG state."""
+    generator = RandomGenerator(seed_value if seed_value is not None else 0)
     if seed_value is None:
-        seed_value = GAME_LOGIC_SEED[0]
+        seed_value = generator.values[0]
+    slots = [(p.get("Template", "-1"), p.get("Color", "-1")) for p in player_info if is_playing_slot(p)]
+    key = ("parse", list(generator.values), seed_value, sorted(available_templates), sorted(available_colors), slots)
+    resolved = iter(RANDOM_ASSIGNMENTS.get(key, lambda: resolve_random_template_and_color(generator, slots, seed_value, available_templates, available_colors)))
     for player in player_info:
-        if player["Type"] in ("Human",) or player["Type"].startswith("AI"):
+        if is_playing_slot(player):
             original_template = player.get("original_template", -1)
             original_color = player.get("original_color", -1)
             player["original_template"] = original_template
             player["original_color"] = original_color
-            tpl_val = player.get("Template", "-1")
-            if tpl_val == "-1":
-                silly = seed_value % 7
-                for _ in range(silly):
-                    _ = get_game_logic_random_value(0, 1)
-                idx = get_game_logic_random_value(0, 1000) % len(valid_templates)
-                template_index = valid_templates[idx]
-            elif tpl_val == "-2":
-                template_index = 1
-            else:
-                try:
-                    template_index = int(tpl_val)
-                    if template_index not in available_templates:
-                        silly = seed_value % 7
-                        for _ in range(silly):
-                            _ = get_game_logic_random_value(0, 1)
-                        idx = get_game_logic_random_value(0, 1000) % len(valid_templates)
-                        template_index = valid_templates[idx]
-                except ValueError:
-                    silly = seed_value % 7
-                    for _ in range(silly):
-                        _ = get_game_logic_random_value(0, 1)
-                    idx = get_game_logic_random_value(0, 1000) % len(valid_templates)
-                    template_index = valid_templates[idx]
+            template_index, color_index = next(resolved)
             player["template_index"] = template_index
             player["template"] = available_templates.get(template_index, "Unknown")
             if "Template" in player:
                 del player["Template"]
-            col_val = player.get("Color", "-1")
-            if col_val == "-1":
-                color_index = get_game_logic_random_value(0, len(available_colors)-1)
-                while color_index in taken_colors:
-                    color_index = get_game_logic_random_value(0, len(available_colors)-1)
-            else:
-                try:
-                    color_index = int(col_val)
-                    if color_index not in available_colors:
-                        color_index = get_game_logic_random_value(0, len(available_colors)-1)
-                except ValueError:
-                    color_index = get_game_logic_random_value(0, len(available_colors)-1)
-            taken_colors.add(color_index)
             player["color_index"] = color_index
             player["color"] = available_colors.get(color_index, "Unknown")
             if "Color" in player:
@@ -531,8 +441,10 @@ def assign_random_template_and_color(player_info, available_templates, available
 # ----------------------------
 # Process a Single Replay File
 # ----------------------------
-def process_replay_file(rep_file_path):
-    parsed_data = parse_rep_file(rep_file_path)
+def process_replay_file(rep_file_path, output_format=None, laps=NO_LAPS):
+    output_format = output_format or OUTPUT_FORMAT
+    parsed_data = parse_rep_file(rep_file_path, columnar=(output_format == "columnar"))
+    laps.lap("parse")
     header = parsed_data['header']
     messages = parsed_data['messages']
     version_str = header.get("version_string", "").strip()
@@ -543,13 +455,11 @@ def process_replay_file(rep_file_path):
     original_player_info = parse_player_info(game_options)
     map_name = get_map_name(game_options)
     seed_from_header = extract_seed_from_options(game_options)
-    if seed_from_header is not None:
-        init_random(seed_from_header)
-    else:
-        init_random(0)
+    laps.lap("slots")
     processed_player_info = assign_random_template_and_color(
         original_player_info.copy(), AVAILABLE_TEMPLATES, AVAILABLE_COLORS, seed_value=seed_from_header
     )
+    laps.lap("prng")
     local_slot = header.get('local_player_index', -1)
     local_player_index = None
     for p in processed_player_info:
@@ -563,6 +473,8 @@ def process_replay_file(rep_file_path):
         "player_info": processed_player_info,
         "messages": messages
     }
+    if output_format == "columnar":
+        data["arg_blob"] = parsed_data['arg_blob']
     dup_key = (seed_from_header, json.dumps(original_player_info, sort_keys=True), map_name)
     frame_duration = header.get("frame_duration", 0)
     record = {
@@ -573,6 +485,7 @@ def process_replay_file(rep_file_path):
         "frame_duration": frame_duration,
         "data": data
     }
+    laps.lap("record")
     return record, dup_key
 
 # ----------------------------
@@ -593,99 +506,251 @@ def init_db():
     conn.commit()
     return conn
 
+DUPLICATE_COLUMNS = ("dup_key", "source", "frame_duration", "output_file")
+def open_dedup_store():
+    init_db().close()
+    return DedupStore(DB_FILE, "duplicates", DUPLICATE_COLUMNS, "dup_key", "frame_duration")
+
 # ----------------------------
 # Write Parsed Replay to Zstandard Compressed File
 # ----------------------------
-def write_parsed_file(data, source):
-    base = os.path.splitext(os.path.basename(source))[0]
-    output_file = os.path.join("parsed", base + ".json.zst")
+def next_output_file(base, extension):
+    output_file = os.path.join("parsed", base + extension)
     counter = 1
     while os.path.exists(output_file):
-        output_file = os.path.join("parsed", f"{base}_{counter}.json.zst")
+        output_file = os.path.join("parsed", f"{base}_{counter}{extension}")
         counter += 1
+    return output_file
+
+_output_dictionary = False
+
+def get_output_dictionary():
+    """Loaded once per worker; None when disabled or nothing has been trained yet."""
+    global _output_dictionary
+    if _output_dictionary is False:
+        _output_dictionary = zstd_dict.latest_dictionary("parsed") if USE_ZSTD_DICTIONARY and os.path.isdir("parsed") else None
+    return _output_dictionary
+
+def summarize_parsed_data(data, output_format=None):
+    """The replay summary check_winner reads instead of the messages (see replay_summary.py)."""
+    messages = data["messages"]
+    if (output_format or OUTPUT_FORMAT) == "columnar":
+        return summarize(build_player_index_from_columns(messages["frame"], messages["type"], messages["player"]))
+    return summarize(build_player_index(messages))
+
+def encode_parsed_data(data, output_format=None, laps=NO_LAPS):
+    """
+    Returns (compressed bytes, file extension, sidecar) for a processed replay.
+    .rcol files carry the replay summary in their metadata; for .json.zst the
+    summary comes back as a sidecar dict to write next to the output.
+    """
+    output_format = output_format or OUTPUT_FORMAT
+    dictionary = get_output_dictionary()
+    summary = summarize_parsed_data(data, output_format)
+    laps.lap("summary")
+    if output_format == "columnar":
+        payload = replay_columns.encode_replay(data["header"], data["player_info"], data["messages"], data["arg_blob"],
+                                               dictionary=dictionary, summary=summary)
+        laps.lap("compress")
+        return payload, replay_columns.EXTENSION, None
     json_str = json.dumps(data, indent=4)
-    cctx = zstd.ZstdCompressor(level=3)
-    compressed = cctx.compress(json_str.encode("utf-8"))
+    payload = zstd_dict.compress(json_str.encode("utf-8"), dictionary)
+    laps.lap("compress")
+    return payload, ".json.zst", make_sidecar(data["header"], data["player_info"], summary)
+
+def write_payload(payload, extension, source, sidecar=None):
+    base = os.path.splitext(os.path.basename(source))[0]
+    output_file = next_output_file(base, extension)
     with open(output_file, "wb") as f:
-        f.write(compressed)
+        f.write(payload)
+    if sidecar is not None:
+        write_sidecar(output_file, sidecar)
     print(f"Output written to {output_file}")
     return output_file
 
+def write_parsed_file(data, source, output_format=None):
+    payload, extension, sidecar = encode_parsed_data(data, output_format)
+    return write_payload(payload, extension, source, sidecar)
+
+# ----------------------------
+# Worker: Parse and Encode One Replay
+# ----------------------------
+def parse_worker(rep_file, output_format=None):
+    """
+    Does all per-replay CPU work (parsing, random faction resolution, compression)
+    so it can run in a worker process. Deduplication and file writes stay with
+    the coordinator in main().
+    """
+    laps = new_laps(TIME_STAGES)
+    try:
+        # Rejected replays cost one small header read
+        header, reason = probe_replay(rep_file, REPLAY_FILTERS)
+        laps.lap("header")
+        if not reason:
+            record, dup_key = process_replay_file(rep_file, output_format, laps)
+            if record is None:
+                reason = "invalid_version"
+        if reason:
+            result = {"status": reason, "source": rep_file, "frame_duration": header.get("frame_duration", 0),
+                      "version_string": header.get("version_string", "").strip()}
+        else:
+            payload, extension, sidecar = encode_parsed_data(record["data"], output_format, laps)
+            result = {
+                "status": "ok",
+                "source": record.get("source", rep_file),
+                "frame_duration": record.get("frame_duration", 0),
+                "dup_key": json.dumps(dup_key, sort_keys=True),
+                "payload": payload,
+                "extension": extension,
+                "sidecar": sidecar
+            }
+    except Exception as e:
+        result = {"status": "error", "source": rep_file, "error": str(e)}
+    # New random assignments go back to the coordinator, which saves the cache
+    result["assignments"] = RANDOM_ASSIGNMENTS.take_new()
+    if laps.times is not None:
+        result["timings"] = laps.times
+        result["worker"] = worker_id()
+    return result
+
 # ----------------------------
 # Main Processing Function
 # ----------------------------
-def main():
+def main(workers=None):
     parse_all = True  # Change to False to limit processing.
     max_files = 100   # Maximum files if not processing all.
     os.makedirs("parsed", exist_ok=True)
-    if os.path.exists(DB_FILE):
+    if os.path.exists(DB_FILE) and not INCREMENTAL:
         os.remove(DB_FILE)
         print(f"Deleted existing database file: {DB_FILE}")
-    conn = init_db()
-    cursor = conn.cursor()
+    store = open_dedup_store()
     rep_files = glob.glob("**/*.rep", recursive=True)
     if not rep_files:
         print("No .rep files found.")
+        store.close()
         return
     filtered_files = [f for f in rep_files if os.path.basename(f).split('_')[1] == "1v1"]
     total_files = len(filtered_files)
     if total_files == 0:
         print("No 1v1 .rep files found.")
+        store.close()
         return
     print(f"Found {total_files} 1v1 replay files. Beginning processing...")
     skipped_low_duration = 0
     skipped_duplicates = 0
     skipped_versions = 0
-    processed = 0
-    for rep_file in filtered_files:
-        if not parse_all and processed >= max_files:
-            print(f"Reached max_files limit of {max_files}.")
-            break
-        processed += 1
-        print(f"Processing file {processed}/{total_files}: {rep_file}")
-        try:
-            record, dup_key = process_replay_file(rep_file)
-            if record is None:
+    skipped_filtered = {}
+    if not parse_all and total_files > max_files:
+        print(f"Reached max_files limit of {max_files}.")
+        filtered_files = filtered_files[:max_files]
+    index = ReplayIndex(INDEX_FILE) if INCREMENTAL else None
+    if index is not None:
+        index.prune(rep_files)
+        unchanged = [f for f in filtered_files if index.get("parse", f)[0]]
+        if unchanged:
+            print(f"Skipping {len(unchanged)} replays unchanged since the last run.")
+            unchanged = set(unchanged)
+            filtered_files = [f for f in filtered_files if f not in unchanged]
+    workers = workers or WORKERS
+    load_assignment_cache()
+    if workers <= 1:
+        pool = None
+    elif USE_THREADS:
+        pool = ThreadPool(processes=workers)
+    else:
+        pool = Pool(processes=workers, initializer=load_assignment_cache, initargs=(ASSIGNMENT_CACHE_FILE,))
+    if pool is not None:
+        print(f"Parsing with {workers} worker {'threads' if USE_THREADS else 'processes'}.")
+        results = pool.imap_unordered(parse_worker, filtered_files, chunksize=CHUNK_SIZE)
+    else:
+        results = map(parse_worker, filtered_files)
+    timings = StageTimings() if TIME_STAGES else None
+    try:
+        for processed, (result, laps) in enumerate(timed_results(results, timings, "source"), start=1):
+            rep_file = result["source"]
+            print(f"Processing file {processed}/{len(filtered_files)}: {rep_file}")
+            for key, value in result.get("assignments", ()):
+                RANDOM_ASSIGNMENTS.put(key, value)
+            if result["status"] == "error":
+                print(f"Error processing {rep_file}: {result['error']}")
+                continue
+            if index is not None and result["status"] != "ok":
+                index.put("parse", rep_file, result["status"]) # Kept replays are recorded once written
+            if result["status"] == "invalid_version":
                 skipped_versions += 1
+                print(f"Skipping {rep_file} due to unsupported version: {result.get('version_string', '')}")
                 continue
-            if record["frame_duration"] < 600:
+            if result["status"] == "low_duration":
                 skipped_low_duration += 1
-                print(f"Skipping {rep_file} due to low duration ({record['frame_duration']} frames).")
+                print(f"Skipping {rep_file} due to low duration ({result['frame_duration']} frames).")
                 continue
-            dup_key_str = json.dumps(dup_key, sort_keys=True)
-            source = record.get("source", "unknown")
-            frame_duration = record.get("frame_duration", 0)
-            cursor.execute("SELECT frame_duration, source, output_file FROM duplicates WHERE dup_key = ?", (dup_key_str,))
-            row = cursor.fetchone()
-            if row:
-                existing_duration = row[0]
-                if frame_duration > existing_duration:
-                    old_output_file = row[2]
-                    if os.path.exists(old_output_file):
-                        os.remove(old_output_file)
-                        print(f"Removed older replay file: {old_output_file}")
-                    cursor.execute("UPDATE duplicates SET source = ?, frame_duration = ?, output_file = ? WHERE dup_key = ?",
-                                   (source, frame_duration, write_parsed_file(record["data"], source), dup_key_str))
-                    conn.commit()
-                    print(f"Duplicate for {source} replaced because new replay has higher duration ({frame_duration} vs {existing_duration}).")
-                    skipped_duplicates += 1
+            if result["status"] != "ok":
+                skipped_filtered[result["status"]] = skipped_filtered.get(result["status"], 0) + 1
+                print(f"Skipping {rep_file} ({result['status']} filter).")
+                continue
+            try:
+                dup_key_str = result["dup_key"]
+                source = rep_file
+                frame_duration = result["frame_duration"]
+                laps.skip()
+                is_longer, row = store.check(dup_key_str, frame_duration)
+                laps.lap("dedup_db")
+                if row:
+                    existing_duration = row[2]
+                    if is_longer:
+                        old_output_file = row[3]
+                        if os.path.exists(old_output_file):
+                            os.remove(old_output_file)
+                            remove_sidecar(old_output_file)
+                            print(f"Removed older replay file: {old_output_file}")
+                        output_file = write_payload(result["payload"], result["extension"], source, result["sidecar"])
+                        laps.lap("write")
+                        store.put((dup_key_str, source, frame_duration, output_file))
+                        laps.lap("dedup_db")
+                        print(f"Duplicate for {source} replaced because new replay has higher duration ({frame_duration} vs {existing_duration}).")
+                        skipped_duplicates += 1
+                    else:
+                        skipped_duplicates += 1
+                        print(f"Duplicate found for {source}. Skipping this replay (duration {frame_duration} vs {existing_duration}).")
                 else:
-                    skipped_duplicates += 1
-                    print(f"Duplicate found for {source}. Skipping this replay (duration {frame_duration} vs {existing_duration}).")
-            else:
-                output_file = write_parsed_file(record["data"], source)
-                cursor.execute("INSERT INTO duplicates (dup_key, source, frame_duration, output_file) VALUES (?,?,?,?)",
-                               (dup_key_str, source, frame_duration, output_file))
-                conn.commit()
+                    output_file = write_payload(result["payload"], result["extension"], source, result["sidecar"])
+                    laps.lap("write")
+                    store.put((dup_key_str, source, frame_duration, output_file))
+                    laps.lap("dedup_db")
+                if index is not None:
+                    index.put("parse", rep_file, "ok")
+            except Exception as e:
+                print(f"Error processing {rep_file}: {e}")
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    store.flush()
+    if EXPORT_DATASET:
+        output_files = [row[3] for row in store.rows()]
+        try:
+            import export_dataset
+            added = export_dataset.export_parsed_files(output_files)
+            print(f"Added {added} replays to dataset {export_dataset.DATASET_DIR}")
         except Exception as e:
-            print(f"Error processing {rep_file}: {e}")
-        time.sleep(0.005)
-    conn.close()
+            print(f"Error exporting dataset: {e}")
+    store.close()
     print("Finished processing.")
+    print(f"Duplicate table writes: {store.report()}")
+    if index is not None:
+        index.close()
+        print(f"Replay index: {index.report()}")
+    if ASSIGNMENT_CACHE_FILE:
+        RANDOM_ASSIGNMENTS.save(ASSIGNMENT_CACHE_FILE)
+        print(f"Saved {len(RANDOM_ASSIGNMENTS.entries)} random assignments to {ASSIGNMENT_CACHE_FILE}")
     print(f"Replays skipped due to low duration: {skipped_low_duration}")
     print(f"Replays skipped as duplicates: {skipped_duplicates}")
     print(f"Replays excluded due to unsupported version: {skipped_versions}")
-    if os.path.exists(DB_FILE):
+    for reason, count in sorted(skipped_filtered.items()):
+        print(f"Replays excluded by the {reason} filter: {count}")
+    if timings is not None:
+        print_summary(timings.dump(STAGE_TIMINGS_FILE), STAGE_TIMINGS_FILE)
+    if os.path.exists(DB_FILE) and not INCREMENTAL:
         os.remove(DB_FILE)
         print(f"Deleted duplicates database file: {DB_FILE}")
 
@@ -1,4 +1,10 @@
 import prng
+from dedup_store import DedupStore
+from replay_index import ReplayIndex, INDEX_FILE
+from replay_reader import scan_timeline
+from replay_fetch import get_default_fetcher
+from download_cache import DownloadCache
+from stage_timing import Laps, StageTimings, NO_LAPS, new_laps, timed_results, worker_id, dump_passes, print_summary
 import re
 from datetime import datetime, timedelta, timezone, UTC
 import time
@@ -34,10 +40,31 @@ if MATPLOTLIB_AVAILABLE:
 
 from multiprocessing import Pool, cpu_count # Import multiprocessing
 from functools import partial # For passing arguments to pool workers
+from itertools import chain
 
 # --- Constants ---
 DB_FILE = "replay_stats.db"
 
+# Persistent per-file cache of Pass 1 keys and Pass 2 results (replay_index.py),
+# so reruns only parse new or changed replays. INDEX_CONTENT_HASH also accepts
+# files whose mtime changed but whose content did not.
+USE_REPLAY_INDEX = True
+INDEX_CONTENT_HASH = False
+
+# Online replays (mode 2) are kept in a local content-addressed cache
+# (download_cache.py) and revalidated with ETag / If-Modified-Since, so
+# repeat runs over the same URLs do not download them again.
+USE_DOWNLOAD_CACHE = True
+DOWNLOAD_CACHE_DIR = "download_cache"
+DOWNLOAD_CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+# Time each replay's stages (Pass 1: header scan and dedup DB; Pass 2: read,
+# header decode, message timeline, slots, PRNG, quit/CRC analysis, idle check,
+# result and replay index) and write histograms plus the slowest replays per
+# pass to STAGE_TIMINGS_FILE (see stage_timing.py).
+TIME_STAGES = False
+STAGE_TIMINGS_FILE = "parseV2_stage_timings.json"
+
 # Valid versions (case-insensitive comparison will be used)
 VALID_VERSIONS = {"Version 1.04", "버전 1.04", "版本 1.04", "Версия 1.04", "Versión 1.04", "Versione 1.04"}
 VALID_VERSIONS_LOWER = {v.lower() for v in VALID_VERSIONS} # Pre-compute lowercase set
@@ -143,17 +170,9 @@ def is_valid_utf8(byte_string):
     try: byte_string.decode('utf-8'); return True
     except UnicodeDecodeError: return False
 
-def hex_to_decimal(hex_string):
-    """Converts little-endian hex string to decimal integer."""
-    try:
-        if len(hex_string) % 2 != 0: hex_string = '0' + hex_string
-        return int.from_bytes(bytes.fromhex(hex_string), byteorder='little', signed=False)
-    except (ValueError, TypeError): return 0
-
 def assign_random_faction(game_prng, total_factions, game_sd):
     """Assigns a random faction using the game's PRNG logic."""
-    discard = game_sd % 7
-    for _ in range(discard): game_prng.get_value(0, 1)
+    game_prng.discard(game_sd % 7)
     return game_prng.get_value(0, 1000) % total_factions
 
 def assign_random_color(game_prng, total_colors, taken_colors):
@@ -168,6 +187,22 @@ def assign_random_color(game_prng, total_colors, taken_colors):
             if not taken_colors[i]: color_index = i; taken_colors[i] = True; break
     return color_index
 
+# Duplicate POVs of a match share seed and slots, so they share the PRNG result
+RANDOM_ASSIGNMENTS = prng.AssignmentCache()
+
+def resolve_random_assignments(game_sd, slots):
+    """Resolves random (-1) factions and colors for (faction, color) slots in player-number order."""
+    game_prng = prng.RandomGenerator(game_sd); total_colors = 8; total_factions = 12
+    taken_colors = [False] * total_colors
+    for _, color in slots:
+        if color != -1 and 0 <= color < total_colors: taken_colors[color] = True
+    resolved = []
+    for faction, color in slots:
+        if faction == -1: faction = assign_random_faction(game_prng, total_factions, game_sd)
+        if color == -1: color = assign_random_color(game_prng, total_colors, taken_colors)
+        resolved.append([faction, color])
+    return resolved
+
 def ddhhmmss(seconds):
     """Formats seconds into DD:HH:MM:SS.ff or shorter formats."""
     if not isinstance(seconds, (int, float)) or seconds < 0: return '00s 00f'
@@ -187,23 +222,33 @@ def ddhhmmss(seconds):
         return f"{int_secs:02}s {frames:02}f"
     except Exception: return '??s ??f'
 
-def get_replay_data(filename, mode):
-    """Gets replay data from local file or URL."""
+def make_download_cache():
+    return DownloadCache(DOWNLOAD_CACHE_DIR, DOWNLOAD_CACHE_MAX_BYTES) if USE_DOWNLOAD_CACHE else None
+
+def get_fetcher():
+    """Process-wide fetcher, so single downloads also reuse connections and the download cache."""
+    return get_default_fetcher(make_download_cache)
+
+def get_replay_data(filename, mode, content=None, laps=NO_LAPS):
+    """Gets replay data from local file or URL; `content` skips the download for bytes already fetched."""
     header = None; data = None
     try:
         if mode == 1:
-            with open(filename, 'rb') as f: header, data = parse_replay_data(f)
+            with open(filename, 'rb') as f: content = f.read() # One read, then the header is decoded from memory
         elif mode == 2:
-            response = requests.get(filename, timeout=10); response.raise_for_status()
-            with BytesIO(response.content) as f: header, data = parse_replay_data(f)
+            if content is None: content = get_fetcher().fetch(filename)
         else: print(f"Invalid mode for get_replay_data: {mode}")
+        laps.lap("read")
+        if content is not None:
+            with BytesIO(content) as f: header, data = parse_replay_data(f)
+            laps.lap("header")
     except FileNotFoundError: print(f"Error: Replay file not found: {filename}")
     except requests.exceptions.RequestException as e: print(f"Error retrieving online replay {filename}: {e}")
     except Exception as e: print(f"Error processing replay data for {filename}: {e}")
-    return header or {}, data or ""
+    return header or {}, data or b""
 
 def parse_replay_data(f):
-    """Parses the replay header and returns header dict and hex data string."""
+    """Parses the replay header and returns header dict and the raw message bytes."""
     magic = f.read(6)
     if magic != b'GENREP': raise ValueError("Invalid replay file format")
     begin_timestamp, end_timestamp, replay_duration = struct.unpack('<III', f.read(12))
@@ -220,7 +265,7 @@ def parse_replay_data(f):
     try: local_player_index = int(local_player_index_str) if local_player_index_str else -1
     except ValueError: local_player_index = -1
     difficulty, original_game_mode, rank_points, max_fps = struct.unpack('<iiii', f.read(16))
-    hex_data = f.read().hex()
+    body = f.read()
     header = {
         "magic": magic, "begin_timestamp": begin_timestamp, "end_timestamp": end_timestamp,
         "replay_duration": replay_duration, "desync": desync, "early_quit": early_quit,
@@ -231,7 +276,7 @@ def parse_replay_data(f):
         "original_game_mode": original_game_mode, "rank_points": rank_points, "max_fps": max_fps,
         "is_corrupt": is_corrupt,
     }
-    return header, hex_data
+    return header, body
 
 def fix_empty_slot_issue(slots_data):
     """Maps original slot index to occupied slot index."""
@@ -240,40 +285,27 @@ def fix_empty_slot_issue(slots_data):
         if slot not in ('X', 'O', ''): initial_indices[i] = occupied_idx; occupied_idx += 1
     return initial_indices
 
-def get_pl_num_offset(player_slot, slots_data, hex_data):
+def get_pl_num_offset(player_slot, slots_data, timeline):
     """Determine the player number offset based on CRC messages."""
     fixed_slots = fix_empty_slot_issue(slots_data)
     if player_slot not in fixed_slots:
          if 0 in fixed_slots: player_slot = 0 # Fallback: assume first player if local slot invalid
          else: return 2, 2, False # Default offset if truly lost
-    offset = 2; pl_num_from_first_crc = []
-    index_of_first_crc = hex_data.find("00470400000") # Find first logic CRC start
-    if index_of_first_crc != -1 and index_of_first_crc >= 8: # Need space for frame
-        frame_hex = hex_data[index_of_first_crc-8:index_of_first_crc] # Get frame before CRC msg
-        pattern = f"{frame_hex}470400000." # Match frame, type, and the player number hex digit
-        found_crcs = set(re.findall(pattern, hex_data))
-        if len(found_crcs) >= len(fixed_slots): # Check if we found at least enough CRCs
-            try:
-                sorted_crc_msgs = sorted(list(found_crcs))
-                pl_num_from_first_crc = [int(crc_msg[-1], 16) for crc_msg in sorted_crc_msgs]
-                if pl_num_from_first_crc:
-                    offset = pl_num_from_first_crc[0] # Assume lowest player number found corresponds to offset
-                    num_player = offset + fixed_slots[player_slot]
-                    # Check end-of-game message pattern
-                    if hex_data.endswith(f"1b0000000{num_player:x}00000000"): return num_player, offset, True
-                    if hex_data[-18:-10] == '1b000000': # End pattern exists but player num differs
-                         end_num = int(hex_data[-9:-8], 16)
-                         num_player = end_num; offset = num_player - fixed_slots[player_slot]
-                         return num_player, offset, True
-                    return num_player, offset, False # No clear end pattern, rely on CRC offset
-            except (ValueError, IndexError): pass # Fallback on error
-    # Fallback if not enough CRC messages found or initial find failed
+    pl_num_from_first_crc = timeline.first_crc_players() # Players sending the first logic CRC
+    if pl_num_from_first_crc and len(pl_num_from_first_crc) >= len(fixed_slots): # Check if we found at least enough CRCs
+        offset = pl_num_from_first_crc[0] # Assume lowest player number found corresponds to offset
+        num_player = offset + fixed_slots[player_slot]
+        # Check end-of-game message
+        if timeline.end_player == num_player: return num_player, offset, True
+        if timeline.end_player is not None: # End message exists but player num differs
+             num_player = timeline.end_player; offset = num_player - fixed_slots[player_slot]
+             return num_player, offset, True
+        return num_player, offset, False # No end message, rely on CRC offset
+    # Fallback if not enough CRC messages found
     offset = 2; num_player = offset + fixed_slots.get(player_slot, 0)
-    if hex_data[-18:-10] == '1b000000': # Check end pattern as a last resort
-        try:
-            num_player = int(hex_data[-9:-8], 16); offset = num_player - fixed_slots.get(player_slot, 0)
-            return num_player, offset, True
-        except (ValueError, IndexError): pass
+    if timeline.end_player is not None: # Check end message as a last resort
+        num_player = timeline.end_player; offset = num_player - fixed_slots.get(player_slot, 0)
+        return num_player, offset, True
     return num_player, offset, False
 
 def comp_name(comp_char):
@@ -318,18 +350,7 @@ def find_winning_team(teams_data):
     if teams_quit: teams_quit.sort(key=lambda x: x[1], reverse=True); return True, teams_quit[0][0] # All quit, latest quitter wins
     return False, 0 # No teams remaining or quit (empty?)
 
-def extract_frame(hex_data, index):
-    """Extracts frame value (4 bytes, little-endian) before a message index."""
-    if index < 8 or index > len(hex_data): return 0
-    return hex_to_decimal(hex_data[index-8:index])
-
-def extract_crc(hex_data, index):
-    """Extracts CRC value (4 bytes, little-endian) from a CRC message."""
-    crc_start_index = index + 30 # Offset from start of 4704 msg to CRC value
-    if crc_start_index + 8 > len(hex_data): return 0
-    return hex_to_decimal(hex_data[crc_start_index : crc_start_index+8])
-
-def update_players_data(num_player, hex_data, quit_data, teams, teams_data, winning_team, players_quit_frames, observer_num_list, last_crc_data, last_crc_index, found_winner):
+def update_players_data(num_player, timeline, quit_data, teams, teams_data, winning_team, players_quit_frames, observer_num_list, last_crc_data, last_crc_index, found_winner):
     """Determines surrender/exit/idle times based on quit messages and CRC data."""
     max_losers_index = -1 # Index of the latest quit message among losers
     if found_winner and len(teams) > 1:
@@ -345,17 +366,17 @@ def update_players_data(num_player, hex_data, quit_data, teams, teams_data, winn
                 player_quit_time = quit_data.get(player_num, [-1])[0]
                 # Player's CRC is valid if they didn't quit before owner's last CRC frame
                 if player_quit_time == -1 or last_crc_index < player_quit_time:
-                     crc_val = extract_crc(hex_data, last_crc_data[player_num])
+                     crc_val = last_crc_data[player_num]
                      if crc_val != 0: player_data['last_crc'] = crc_val
 
     # Process quit messages (4504 type)
     for player_num, player_data in players_quit_frames.items():
         if player_num not in quit_data: continue
         quit_indices = quit_data[player_num]
-        frame_time = extract_frame(hex_data, quit_indices[0]) # Time of first quit message
+        frame_time = timeline.frame_at(quit_indices[0]) # Time of first quit message
         if len(quit_indices) > 1: # Multiple quits -> Surrender then Exit
             player_data['surrender'] = frame_time
-            player_data['exit'] = extract_frame(hex_data, quit_indices[1]); continue
+            player_data['exit'] = timeline.frame_at(quit_indices[1]); continue
         # Single Quit Message Logic:
         if player_num in observer_num_list: player_data['exit'] = frame_time; continue # Observers just exit
         if player_num in last_crc_data and last_crc_index > quit_indices[0]: player_data['surrender'] = frame_time; continue # Sent CRC after quit -> Surrender
@@ -364,7 +385,7 @@ def update_players_data(num_player, hex_data, quit_data, teams, teams_data, winn
         if num_player in quit_data: # Compare to owner's quit
             owner_last_activity_index = max(quit_data[num_player])
             if quit_indices[0] < owner_last_activity_index: # Quit before owner finished
-                 owner_crc_after_player_quit = hex_data.find(f"470400000{num_player:x}", quit_indices[0])
+                 owner_crc_after_player_quit = timeline.next_crc(num_player, quit_indices[0])
                  if owner_crc_after_player_quit != -1 and owner_crc_after_player_quit < owner_last_activity_index: player_data['surrender'] = frame_time # Owner active after -> Surrender
                  else: player_data['surrender/exit?'] = frame_time # Ambiguous
                  continue
@@ -424,11 +445,13 @@ def get_match_id(url, start_time, game_sd, match_type, map_crc, player_nicks):
 
 # --- Main Replay Parsing Logic ---
 
-def get_replay_info(file_path, mode, rename_info=False):
+def get_replay_info(file_path, mode, rename_info=False, content=None, laps=NO_LAPS):
     """Parses a Generals Zero Hour replay file (local or online)."""
     try:
-        header, hex_data = get_replay_data(file_path, mode)
-        if not header or not hex_data: return None if not rename_info else "parsing_failed"
+        header, body = get_replay_data(file_path, mode, content, laps)
+        if not header or not body: return None if not rename_info else "parsing_failed"
+        timeline = scan_timeline(body)
+        laps.lap("timeline")
 
         # --- Extract Core Header Info ---
         start_time = header.get('begin_timestamp', 0); rep_duration_header = header.get('replay_duration', 0)
@@ -464,7 +487,7 @@ def get_replay_info(file_path, mode, rename_info=False):
         start_cash = match_data.get('SC', '10000'); sw_restriction_val = match_data.get('SR', '0'); sw_restriction = 'Yes' if sw_restriction_val == '1' else 'No'
 
         # --- Determine Player Number Offset ---
-        num_player, offset, is_normal_rep = get_pl_num_offset(player_slot, slots_data, hex_data)
+        num_player, offset, is_normal_rep = get_pl_num_offset(player_slot, slots_data, timeline)
 
         # --- Initialize Player/Team Data ---
         players = {}; teams = {}; player_nicks = []; observer_num_list = []; player_num_list = []
@@ -502,81 +525,58 @@ def get_replay_info(file_path, mode, rename_info=False):
                 if player_num_current in players: del players[player_num_current]
                 continue
 
+        laps.lap("slots")
+
         # --- Resolve Random Factions/Colors ---
-        game_prng = prng.RandomGenerator(game_sd); total_colors = 8; total_factions = 12
-        taken_colors = [False] * total_colors
-        for p_data in players.values():
-            if p_data['color'] != -1 and 0 <= p_data['color'] < total_colors: taken_colors[p_data['color']] = True
-        for p_num in sorted(players.keys()):
-            p_data = players[p_num]
-            if p_data['faction'] == -1: p_data['faction'] = assign_random_faction(game_prng, total_factions, game_sd)
-            if p_data['color'] == -1: p_data['color'] = assign_random_color(game_prng, total_colors, taken_colors)
+        slots = [(players[p_num]['faction'], players[p_num]['color']) for p_num in sorted(players.keys())]
+        resolved = RANDOM_ASSIGNMENTS.get(("parseV2", game_sd, slots), lambda: resolve_random_assignments(game_sd, slots))
+        for p_num, (faction, color) in zip(sorted(players.keys()), resolved):
+            players[p_num]['faction'] = faction; players[p_num]['color'] = color
+        laps.lap("prng")
 
         # --- Finalize Teams and Match Type ---
         teams, players = fix_teams(teams, players); match_type = get_match_type(teams)
 
         # --- Analyze Quit/End Game Data ---
-        quit_data = {}
-        for match in re.finditer(r'450400000(.)000000010201', hex_data):
-            try: match_str_num = int(match.group(1), 16); match_index = match.start()
-            except ValueError: continue
-            if match_str_num in players: quit_data.setdefault(match_str_num, []).append(match_index)
-        for p_num in quit_data: quit_data[p_num].sort()
-
-        last_crc_data = {}; last_crc_index = -1; last_crc_frame_hex = "00000000"
-        owner_crc_pattern = f"470400000{num_player:x}0000000200010201"
-        last_crc_index = hex_data.rfind(owner_crc_pattern)
+        quit_data = {p_num: list(indices) for p_num, indices in timeline.quits.items() if p_num in players}
+
+        last_crc_data = {}; last_crc_frame = 0
+        last_crc_index = timeline.last_crc.get(num_player, -1) # Owner's last CRC
         if last_crc_index != -1:
-            last_crc_frame_hex = hex_data[last_crc_index-8:last_crc_index]
-            frame_crc_pattern = f"{last_crc_frame_hex}470400000(.)0000000200010201"
-            for match in re.finditer(frame_crc_pattern, hex_data):
-                 try: match_str_num = int(match.group(1), 16)
-                 except ValueError: continue
-                 if match_str_num in players: last_crc_data[match_str_num] = match.start()
+            last_crc_frame = timeline.frame_at(last_crc_index)
+            last_crc_data = {p_num: crc for p_num, (_, crc) in timeline.crcs_at(last_crc_frame).items() if p_num in players}
 
         # --- Determine Player Status (Surrender, Exit, Idle) ---
         players_quit_frames = {p: {'surrender': 0, 'exit': 0, 'last_crc': '', 'surrender/exit?': 0, 'idle/kicked?': 0} for p in players}
         teams_data = {t: [quit_data.get(p, [-1])[0] for p in pl] for t, pl in teams.items()}
         found_winner, winning_team = find_winning_team(teams_data)
-        update_players_data(num_player, hex_data, quit_data, teams, teams_data, winning_team, players_quit_frames, observer_num_list, last_crc_data, last_crc_index, found_winner)
+        update_players_data(num_player, timeline, quit_data, teams, teams_data, winning_team, players_quit_frames, observer_num_list, last_crc_data, last_crc_index, found_winner)
 
         # --- Determine Actual Replay End Frame ---
         actual_replay_end_frame = rep_duration_header
         if found_winner and len(teams) > 1:
             try:
                 loser_quit_indices = [max(quit_data[p_num]) for t, p_list in teams.items() if t != winning_team for p_num in p_list if p_num in quit_data]
-                if loser_quit_indices: actual_replay_end_frame = extract_frame(hex_data, max(loser_quit_indices))
+                if loser_quit_indices: actual_replay_end_frame = timeline.frame_at(max(loser_quit_indices))
             except (ValueError, KeyError): pass
-        elif num_player in quit_data: actual_replay_end_frame = extract_frame(hex_data, max(quit_data[num_player]))
-        elif last_crc_index > 0: actual_replay_end_frame = hex_to_decimal(last_crc_frame_hex)
+        elif num_player in quit_data: actual_replay_end_frame = timeline.frame_at(max(quit_data[num_player]))
+        elif last_crc_index > 0: actual_replay_end_frame = last_crc_frame
         if actual_replay_end_frame > rep_duration_header and rep_duration_header > 0: actual_replay_end_frame = rep_duration_header
 
-        # --- Check for Idle/Kick (Second Pass - Optional/Simplified) ---
-        # This section can be slow and complex. Consider simplifying or removing if not essential.
+        laps.lap("quit_crc")
+
+        # --- Check for Idle/Kick ---
         update_players_data_again = False; idle_kick_indices = []
         player_final_message_frame = actual_replay_end_frame
         if player_final_message_frame >= 5400: # Idle check heuristic
-            patterns_to_ignore = ["001b0000000", "00470400000", "00490400000", "00eb0300000", "00e90300000", "00220400000", "00450400000", "00f80300000", "00f90300000", "00fa0300000", "00fb0300000", "00fc0300000", "00fd0300000", "00fe0300000", "00ff0300000", "00000400000", "00010400000"]
             min_idle_diff = 900; min_kick_diff = 1800
-            search_start_index = max(0, len(hex_data) - 200000) # Limit search range
 
             for p_num, p_status in players_quit_frames.items():
                 if p_num in observer_num_list or p_status['surrender'] != 0: continue
-                last_msg_index = -1
-                try:
-                    # Find last relevant message index (can be slow)
-                    # Consider optimizing this search if it's a bottleneck
-                    relevant_indices = [search_start_index + match.start()
-                                        for match in re.finditer(f'00....00000{p_num:x}000000', hex_data[search_start_index:])
-                                        if not any(match.group(0)[:11] == pattern for pattern in patterns_to_ignore)]
-                    if relevant_indices:
-                        last_msg_index = relevant_indices[-1]
-                except re.error as re_err:
-                    print(f"  Warning: Regex error during idle check for player {p_num}: {re_err}")
-                    continue
+                last_msg_index = timeline.last_action.get(p_num, -1) # Last player-issued message
 
                 if last_msg_index != -1:
-                    msg_frame = extract_frame(hex_data, last_msg_index + 2)
+                    msg_frame = timeline.frame_at(last_msg_index)
                     frame_diff = player_final_message_frame - msg_frame
                     if frame_diff >= min_idle_diff:
                          is_potential_kick = False
@@ -586,13 +586,14 @@ def get_replay_info(file_path, mode, rename_info=False):
                          if is_potential_kick:
                               p_status['idle/kicked?'] = msg_frame
                               if p_num not in quit_data: quit_data[p_num] = []
-                              quit_data[p_num].insert(0, last_msg_index + 2); quit_data[p_num].sort()
-                              idle_kick_indices.append(last_msg_index + 2); update_players_data_again = True
+                              quit_data[p_num].insert(0, last_msg_index); quit_data[p_num].sort()
+                              idle_kick_indices.append(last_msg_index); update_players_data_again = True
 
         if update_players_data_again:
             teams_data = {t: [quit_data.get(p, [-1])[0] for p in pl] for t, pl in teams.items()}
             found_winner, winning_team = find_winning_team(teams_data)
-            update_players_data(num_player, hex_data, quit_data, teams, teams_data, winning_team, players_quit_frames, observer_num_list, last_crc_data, last_crc_index, found_winner)
+            update_players_data(num_player, timeline, quit_data, teams, teams_data, winning_team, players_quit_frames, observer_num_list, last_crc_data, last_crc_index, found_winner)
+        laps.lap("idle")
 
         # --- Determine Final Match Result ---
         match_result = 'Unknown'; winning_team_string = 'Unknown'
@@ -649,6 +650,8 @@ def get_replay_info(file_path, mode, rename_info=False):
                 p_data['is_ai'], p_num
             ))
 
+        laps.lap("result")
+
         # --- Return based on rename_info flag ---
         if rename_info:
             teams_filename = []
@@ -667,6 +670,16 @@ def get_replay_info(file_path, mode, rename_info=False):
         return None if not rename_info else "critical_parsing_error"
 
 
+def get_online_replay_infos(urls, fetcher=None, rename_info=False):
+    """Downloads replays concurrently and parses each from memory; yields (url, result) in completion order."""
+    fetcher = fetcher or get_fetcher()
+    for url, content, error in fetcher.fetch_all(urls):
+        if error is not None:
+            print(f"Error retrieving online replay {url}: {error}")
+            yield url, None if not rename_info else "parsing_failed"; continue
+        yield url, get_replay_info(url, 2, rename_info=rename_info, content=content)
+
+
 # --- Minimal Parser for Pass 1 ---
 
 def parse_minimal_header_for_key(filename):
@@ -745,6 +758,8 @@ def setup_database():
     conn.commit()
     conn.close()
 
+UNIQUE_MATCH_COLUMNS = ("match_key", "longest_replay_path", "max_duration", "game_seed", "map_name", "match_timestamp", "player_hash", "has_ai")
+
 def generate_match_key(game_sd, map_name, begin_timestamp, player_hash):
     """Generates the unique match key."""
     rounded_ts = round(begin_timestamp / 60) * 60
@@ -756,8 +771,15 @@ def generate_match_key(game_sd, map_name, begin_timestamp, player_hash):
 
 def process_single_replay_worker(rep_file):
     """Parses a single replay fully and returns structured results for aggregation."""
+    laps = new_laps(TIME_STAGES)
+    result = process_replay_result(rep_file, laps)
+    if laps.times is not None: result['timings'] = laps.times; result['worker'] = worker_id()
+    return result
+
+def process_replay_result(rep_file, laps=NO_LAPS):
+    """process_single_replay_worker without the timing bookkeeping."""
     try:
-        parsed_data = get_replay_info(rep_file, mode=1)
+        parsed_data = get_replay_info(rep_file, mode=1, laps=laps)
         if parsed_data is None: return {'status': 'error', 'file': rep_file, 'reason': 'get_replay_info_failed'}
         replay_info_list, player_infos = parsed_data
 
@@ -824,6 +846,64 @@ def process_single_replay_worker(rep_file):
         return {'status': 'error', 'file': rep_file, 'reason': f"worker_exception: {e}"}
 
 
+# --- Pass 1 Header Scan ---
+
+PASS1_CHUNK_SIZE = 64
+
+def timed_minimal_header(rep_file):
+    """parse_minimal_header_for_key plus its timing, as a Pass 1 worker result."""
+    laps = Laps()
+    key_info = parse_minimal_header_for_key(rep_file)
+    laps.lap("pass1_header")
+    return {'file': rep_file, 'key_info': key_info, 'timings': laps.times, 'worker': worker_id()}
+
+def split_pass1_cached(rep_files, index):
+    """Returns ({rep_file: cached key_info}, files whose header still has to be parsed)."""
+    cached_keys = {}; files_to_parse = []
+    for rep_file in rep_files:
+        cached, key_info = index.get("pass1", rep_file) if index else (False, None)
+        if cached: cached_keys[rep_file] = key_info
+        else: files_to_parse.append(rep_file)
+    return cached_keys, files_to_parse
+
+def iter_pass1_keys(rep_files, cached_keys, files_to_parse, index, pool, timings=None):
+    """Yields (rep_file, key_info, laps) in rep_files order; cached keys skip the pool (None when all are cached).
+
+    Order matters: for equal durations the first replay seen stays the kept one,
+    so headers are parsed with an ordered imap rather than imap_unordered.
+    With timings given, parsed headers are timed and laps carries on for the
+    caller's dedup stage (see stage_timing.timed_results); otherwise it is NO_LAPS.
+    """
+    if not files_to_parse:
+        parsed = iter(())
+    elif timings is not None:
+        parsed = timed_results(pool.imap(timed_minimal_header, files_to_parse, chunksize=PASS1_CHUNK_SIZE), timings, 'file')
+    else:
+        parsed = ((key_info, NO_LAPS) for key_info in pool.imap(parse_minimal_header_for_key, files_to_parse, chunksize=PASS1_CHUNK_SIZE))
+    for rep_file in rep_files:
+        if rep_file in cached_keys:
+            yield rep_file, cached_keys[rep_file], NO_LAPS
+        else:
+            key_info, laps = next(parsed)
+            if timings is not None: key_info = key_info['key_info']
+            if index: index.put("pass1", rep_file, key_info)
+            laps.skip()
+            yield rep_file, key_info, laps
+    for _ in parsed: pass # Files the last timings
+
+
+def is_cacheable_result(result):
+    """Only results decided by the file's content are cached; read failures and worker exceptions are retried next run."""
+    if not result: return False
+    return result.get('status') != 'error' or result.get('reason') == 'unknown_faction_in_pass2'
+
+
+def restore_cached_result(result):
+    """JSON turns tuples into lists; put back the matchup key used as a dict key."""
+    if result and result.get('matchup_stats'): result['matchup_stats']['key'] = tuple(result['matchup_stats']['key'])
+    return result
+
+
 # --- Main Execution ---
 if __name__ == "__main__":
     start_time_script = time.time()
@@ -833,25 +913,34 @@ if __name__ == "__main__":
         if os.path.exists(DB_FILE): print(f"Removing existing database: {DB_FILE}"); os.remove(DB_FILE)
     except OSError as e: print(f"Warning: Could not remove existing database {DB_FILE}: {e}")
     setup_database()
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+    store = DedupStore(DB_FILE, "unique_matches", UNIQUE_MATCH_COLUMNS, "match_key", "max_duration")
 
-    print("--- Pass 1: Scanning replays and identifying unique matches (Optimized) ---")
+    print("--- Pass 1: Scanning replays and identifying unique matches (Parallelized) ---")
     rep_files = glob.glob('**/*.rep', recursive=True)
     if not rep_files: print("No .rep files found. Exiting."); exit()
+    index = ReplayIndex(INDEX_FILE, use_hash=INDEX_CONTENT_HASH) if USE_REPLAY_INDEX else None
+    if index: index.prune(rep_files)
 
     processed_count_pass1 = 0; skipped_parsing_errors = 0; skipped_unknown_faction_pass1 = 0
     skipped_invalid_version = 0; total_duplicates_skipped = 0
     start_time_pass1 = time.time()
 
-    for rep_file in rep_files:
+    num_workers = max(1, cpu_count() - 1)
+    cached_keys, files_to_parse = split_pass1_cached(rep_files, index)
+    if files_to_parse:
+        print(f"  Scanning {len(files_to_parse)} replay headers using {num_workers} workers ({len(cached_keys)} keys cached).")
+        pass1_pool = Pool(processes=num_workers)
+    else:
+        print(f"  All {len(cached_keys)} replay keys cached, no headers to scan.")
+        pass1_pool = None
+
+    pass1_timings = StageTimings() if TIME_STAGES else None; pass2_timings = StageTimings() if TIME_STAGES else None
+    for rep_file, key_info, laps in iter_pass1_keys(rep_files, cached_keys, files_to_parse, index, pass1_pool, pass1_timings):
         processed_count_pass1 += 1
         if processed_count_pass1 % 500 == 0:
              elapsed = time.time() - start_time_pass1; rate = processed_count_pass1 / elapsed if elapsed > 0 else 0
              print(f"\r  Pass 1: Processed {processed_count_pass1}/{len(rep_files)} files ({rate:.1f} files/sec). Dup: {total_duplicates_skipped}, Err: {skipped_parsing_errors}, UnkF: {skipped_unknown_faction_pass1}, InvV: {skipped_invalid_version}...", end="")
 
-        key_info = parse_minimal_header_for_key(rep_file)
-
         if key_info is None: skipped_parsing_errors += 1; continue
         if key_info.get('invalid_version', False): skipped_invalid_version += 1; continue # Skip invalid version, DO NOT delete
         if key_info.get('unknown_faction', False): skipped_unknown_faction_pass1 += 1; files_to_delete.add(rep_file); continue # Mark unknown faction for deletion
@@ -861,23 +950,26 @@ if __name__ == "__main__":
 
         match_key = generate_match_key(game_sd, map_name, begin_timestamp, player_hash)
 
-        cursor.execute("SELECT max_duration, longest_replay_path FROM unique_matches WHERE match_key = ?", (match_key,))
-        result = cursor.fetchone()
+        is_longer, stored = store.check(match_key, replay_duration)
+        row = (match_key, rep_file, replay_duration, game_sd, map_name, begin_timestamp, player_hash, has_ai)
 
-        if result:
-            stored_duration, stored_path = result
-            if replay_duration > stored_duration:
-                files_to_delete.add(stored_path); cursor.execute("UPDATE unique_matches SET longest_replay_path = ?, max_duration = ?, has_ai = ? WHERE match_key = ?", (rep_file, replay_duration, has_ai, match_key))
+        if stored:
+            stored_path = stored[1]
+            if is_longer:
+                files_to_delete.add(stored_path); store.put(row)
             else:
                 files_to_delete.add(rep_file); total_duplicates_skipped += 1
         else:
-            cursor.execute("INSERT INTO unique_matches VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (match_key, rep_file, replay_duration, game_sd, map_name, begin_timestamp, player_hash, has_ai))
+            store.put(row)
+        laps.lap("dedup_db")
 
-        if processed_count_pass1 % 2000 == 0: conn.commit()
-
-    conn.commit()
+    if pass1_pool: pass1_pool.close(); pass1_pool.join()
+    store.flush()
     end_time_pass1 = time.time()
     print(f"\r{' ' * 120}\r--- Pass 1 Complete ({end_time_pass1 - start_time_pass1:.2f} seconds) ---")
+    print(f"  Dedup DB writes: {store.report()}")
+    conn = store.conn
+    cursor = conn.cursor()
 
     cursor.execute("SELECT longest_replay_path FROM unique_matches WHERE has_ai = 1")
     ai_game_paths = [row[0] for row in cursor.fetchall()]; ai_games_to_delete_count = len(ai_game_paths)
@@ -902,14 +994,22 @@ if __name__ == "__main__":
     if not unique_replay_files_for_stats:
          print("No unique non-AI replays found to process in Pass 2.")
     else:
-        num_workers = max(1, cpu_count() - 1)
         print(f"  Processing {len(unique_replay_files_for_stats)} unique matches using {num_workers} workers.")
         start_time_pass2 = time.time()
 
+        cached_results = []; files_to_parse = []
+        for rep_file in unique_replay_files_for_stats:
+            cached, result = index.get("pass2", rep_file) if index else (False, None)
+            if cached: cached_results.append(restore_cached_result(result))
+            else: files_to_parse.append(rep_file)
+        files_to_parse_set = set(files_to_parse)
+        if index: print(f"  Reusing {len(cached_results)} cached results, parsing {len(files_to_parse)} replays.")
+
         with Pool(processes=num_workers) as pool:
-            results_iterator = pool.imap_unordered(process_single_replay_worker, unique_replay_files_for_stats)
-            for i, result in enumerate(results_iterator):
+            results_iterator = chain(cached_results, pool.imap_unordered(process_single_replay_worker, files_to_parse))
+            for i, (result, laps) in enumerate(timed_results(results_iterator, pass2_timings, 'file')):
                 processed_unique_count += 1
+                if index and is_cacheable_result(result) and result.get('file') in files_to_parse_set: index.put("pass2", result['file'], result); laps.lap("index")
                 if processed_unique_count % 100 == 0 or processed_unique_count == len(unique_replay_files_for_stats):
                      elapsed = time.time() - start_time_pass2; rate = processed_unique_count / elapsed if elapsed > 0 else 0
                      print(f"\r  Pass 2: Processed {processed_unique_count}/{len(unique_replay_files_for_stats)} unique replays ({rate:.1f} replays/sec)...", end="")
@@ -958,10 +1058,16 @@ if __name__ == "__main__":
         end_time_pass2 = time.time()
         print(f"\r{' ' * 120}\r--- Pass 2 Complete ({end_time_pass2 - start_time_pass2:.2f} seconds) ---")
         print(f"  Worker errors during processing: {errors_pass2}")
+        if index: print(f"  Replay index: {index.report()}")
 
         # Recalculate total valid winners based on aggregated data (more accurate with categories)
         total_valid_winners = sum(len(data.get('replay_details', [])) for mt, data in match_type_data.items() if not mt.endswith("_Pro_Maps"))
 
+    if TIME_STAGES:
+        stage_results = dump_passes(STAGE_TIMINGS_FILE, {"pass1": pass1_timings, "pass2": pass2_timings})
+        print("\n--- Stage Timings (Pass 1) ---"); print_summary(stage_results["pass1"])
+        print("--- Stage Timings (Pass 2) ---"); print_summary(stage_results["pass2"], STAGE_TIMINGS_FILE)
+
 
     print("\n--- Generating Charts ---")
     charts_created = []
@@ -1104,6 +1210,7 @@ if __name__ == "__main__":
             except FileNotFoundError: error_delete_count += 1
             except OSError as e: print(f"  Error deleting file {file_to_del}: {e}"); error_delete_count += 1
         print(f"\r{' ' * 50}\r  Finished deleting. Deleted: {deleted_count}, Errors: {error_delete_count}")
+    if index: index.forget(files_to_delete); index.close()
 
 
     print(f"\nResults written to win_rates.txt")
@@ -0,0 +1,66 @@
+import os
+import sys
+import glob
+import json
+import contextlib
+
+import parseV2
+
+# ----------------------------
+# parseV2 Output Regression Check
+# ----------------------------
+# record:  python regression.py record <folder> [baseline.json]
+# compare: python regression.py compare <folder> [baseline.json]
+#
+# Records the replay_info_list / player_infos_list that parseV2.get_replay_info
+# returns for every .rep in a folder, then compares a later run against it, so
+# changes to the parser can be checked for identical output on a corpus.
+BASELINE_FILE = "regression_baseline.json"
+
+def collect(folder):
+    results = {}
+    for rep_file in sorted(glob.glob(os.path.join(folder, "**", "*.rep"), recursive=True)):
+        with open(os.devnull, "w") as null, contextlib.redirect_stdout(null):
+            parsed = parseV2.get_replay_info(rep_file, mode=1)
+        key = os.path.relpath(rep_file, folder)
+        # Round-trip through JSON so tuples compare equal to the stored lists
+        results[key] = json.loads(json.dumps(parsed))
+    return results
+
+def compare(baseline, current):
+    """Returns a list of (file, field, expected, actual) differences."""
+    diffs = []
+    for key in sorted(baseline.keys() | current.keys()):
+        expected = baseline.get(key); actual = current.get(key)
+        if expected == actual: continue
+        if expected is None or actual is None:
+            diffs.append((key, "result", expected, actual)); continue
+        for name, exp_rows, act_rows in (("replay_info", expected[0], actual[0]), ("player_infos", expected[1], actual[1])):
+            for i in range(max(len(exp_rows), len(act_rows))):
+                exp = exp_rows[i] if i < len(exp_rows) else None
+                act = act_rows[i] if i < len(act_rows) else None
+                if exp != act: diffs.append((key, f"{name}[{i}]", exp, act))
+    return diffs
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] not in ("record", "compare"):
+        print("Usage: python regression.py record|compare <folder> [baseline.json]")
+        sys.exit(2)
+    command, folder = sys.argv[1], sys.argv[2]
+    baseline_file = sys.argv[3] if len(sys.argv) > 3 else BASELINE_FILE
+    current = collect(folder)
+    if command == "record":
+        with open(baseline_file, "w", encoding="utf-8") as f:
+            json.dump(current, f, indent=1, ensure_ascii=False)
+        print(f"Recorded {len(current)} replays to {baseline_file}")
+        return
+    with open(baseline_file, encoding="utf-8") as f:
+        baseline = json.load(f)
+    diffs = compare(baseline, current)
+    for key, field, expected, actual in diffs[:50]:
+        print(f"{key} {field}:\n  expected {expected}\n  actual   {actual}")
+    print(f"{len(current)} replays checked, {len(diffs)} differences")
+    sys.exit(1 if diffs else 0)
+
+if __name__ == "__main__":
+    main()
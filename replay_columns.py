@@ -0,0 +1,205 @@
+import os
+import sys
+import glob
+import json
+import struct
+import zstd_dict
+from replay_reader import NUMPY_AVAILABLE, columnar_to_messages
+if NUMPY_AVAILABLE:
+    import numpy as np
+    from replay_reader import MESSAGE_DTYPE
+from replay_summary import build_player_index, summarize
+
+# ----------------------------
+# Container Layout
+# ----------------------------
+# MAGIC | u8 version | u32 index size | zstd(JSON index) | column blocks...
+#
+# The index holds the replay metadata (header + player_info, plus the replay
+# summary from replay_summary.py when given) and, for every
+# column, its dtype and the offset/size of its zstd-compressed block relative
+# to the end of the index. Each column is compressed on its own so a reader
+# only decompresses the columns it asks for. Blocks may be compressed with a
+# shared dictionary (zstd_dict.py), looked up in the file's folder on read.
+MAGIC = b"GRCOLS"
+FORMAT_VERSION = 1
+EXTENSION = ".rcol"
+PREFIX = struct.Struct("<6sBI")
+
+MESSAGE_COLUMNS = MESSAGE_DTYPE.names if NUMPY_AVAILABLE else ()
+ARG_BLOB_COLUMN = "arg_blob"
+
+def require_numpy():
+    if not NUMPY_AVAILABLE:
+        raise ImportError("numpy is required for .rcol message columns. Install it using: pip install numpy")
+
+def encode_replay(header, player_info, table, arg_blob, level=3, dictionary=None, summary=None):
+    require_numpy()
+    cctx = zstd_dict.get_compressor(dictionary, level)
+    blocks = []
+    columns = []
+    offset = 0
+    for name in MESSAGE_COLUMNS:
+        raw = np.ascontiguousarray(table[name]).tobytes()
+        block = cctx.compress(raw)
+        columns.append({"name": name, "dtype": table.dtype[name].str, "offset": offset, "size": len(block), "raw_size": len(raw)})
+        blocks.append(block)
+        offset += len(block)
+    block = cctx.compress(arg_blob)
+    columns.append({"name": ARG_BLOB_COLUMN, "dtype": "|u1", "offset": offset, "size": len(block), "raw_size": len(arg_blob)})
+    blocks.append(block)
+    meta = {"header": header, "player_info": player_info}
+    if summary is not None:
+        meta["summary"] = summary
+    index = {
+        "meta": meta,
+        "rows": len(table),
+        "columns": columns
+    }
+    index_block = cctx.compress(json.dumps(index, separators=(",", ":")).encode("utf-8"))
+    return PREFIX.pack(MAGIC, FORMAT_VERSION, len(index_block)) + index_block + b"".join(blocks)
+
+def write_replay(output_file, header, player_info, table, arg_blob, level=3, dictionary=None, summary=None):
+    with open(output_file, "wb") as f:
+        f.write(encode_replay(header, player_info, table, arg_blob, level, dictionary, summary))
+    return output_file
+
+def _read_index(f, folder):
+    magic, version, index_size = PREFIX.unpack(f.read(PREFIX.size))
+    if magic != MAGIC:
+        raise ValueError("Not a valid replay column file: missing GRCOLS identifier")
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported replay column file version: {version}")
+    index = json.loads(zstd_dict.decompress(f.read(index_size), folder))
+    return index, PREFIX.size + index_size
+
+def read_meta(input_file):
+    """Reads only the header/player_info block."""
+    with open(input_file, "rb") as f:
+        index, _ = _read_index(f, os.path.dirname(input_file))
+    return {**index["meta"], "rows": index["rows"]}
+
+def read_replay(input_file, columns=None):
+    """Loads the metadata plus the requested columns (all of them when columns is None).
+
+    Message columns come back as NumPy arrays, arg_blob as bytes.
+    """
+    require_numpy()
+    folder = os.path.dirname(input_file)
+    with open(input_file, "rb") as f:
+        index, data_start = _read_index(f, folder)
+        wanted = set(MESSAGE_COLUMNS) | {ARG_BLOB_COLUMN} if columns is None else set(columns)
+        loaded = {}
+        for column in index["columns"]:
+            if column["name"] not in wanted:
+                continue
+            f.seek(data_start + column["offset"])
+            raw = zstd_dict.decompress(f.read(column["size"]), folder, max_output_size=column["raw_size"])
+            if column["name"] == ARG_BLOB_COLUMN:
+                loaded[ARG_BLOB_COLUMN] = raw
+            else:
+                loaded[column["name"]] = np.frombuffer(raw, dtype=np.dtype(column["dtype"]))
+    missing = wanted - loaded.keys()
+    if missing:
+        raise KeyError(f"Columns not found in {input_file}: {sorted(missing)}")
+    meta = index["meta"]
+    return {"header": meta["header"], "player_info": meta["player_info"], "rows": index["rows"], "columns": loaded}
+
+def read_raw_blocks(input_file):
+    """The uncompressed index JSON and column blocks, e.g. as dictionary training samples."""
+    folder = os.path.dirname(input_file)
+    with open(input_file, "rb") as f:
+        magic, version, index_size = PREFIX.unpack(f.read(PREFIX.size))
+        if magic != MAGIC:
+            raise ValueError("Not a valid replay column file: missing GRCOLS identifier")
+        index_raw = zstd_dict.decompress(f.read(index_size), folder)
+        index = json.loads(index_raw)
+        return [index_raw] + [zstd_dict.decompress(f.read(column["size"]), folder, max_output_size=column["raw_size"])
+                              for column in index["columns"]]
+
+def load_messages(input_file):
+    """Rebuilds the list-of-dicts message format written by the JSON output."""
+    replay = read_replay(input_file)
+    columns = replay["columns"]
+    table = np.empty(replay["rows"], dtype=MESSAGE_DTYPE)
+    for name in MESSAGE_COLUMNS:
+        table[name] = columns[name]
+    return {
+        "header": replay["header"],
+        "player_info": replay["player_info"],
+        "messages": columnar_to_messages(table, columns[ARG_BLOB_COLUMN])
+    }
+
+# ----------------------------
+# Conversion from .json.zst
+# ----------------------------
+def _arg_code_and_bytes(arg):
+    # JSON drops the on-disk argument types, so pick one whose decoded value is
+    # identical: bools, floats, signed/unsigned ints and the fixed tuples.
+    if isinstance(arg, bool):
+        return 2, struct.pack("<?", arg)
+    if isinstance(arg, float):
+        return 1, struct.pack("<f", arg)
+    if isinstance(arg, int):
+        return (0, struct.pack("<i", arg)) if arg < 0 else (3, struct.pack("<I", arg))
+    if isinstance(arg, (list, tuple)):
+        if len(arg) == 3 and all(isinstance(v, float) for v in arg):
+            return 6, struct.pack("<fff", *arg)
+        if len(arg) == 2:
+            return 7, struct.pack("<ii", *arg)
+        if len(arg) == 4:
+            return 8, struct.pack("<iiii", *arg)
+    raise ValueError(f"Cannot encode message argument: {arg!r}")
+
+def messages_to_columns(messages):
+    require_numpy()
+    table = np.empty(len(messages), dtype=MESSAGE_DTYPE)
+    chunks = []
+    blob_size = 0
+    for i, message in enumerate(messages):
+        runs = []
+        payload = []
+        for arg in message.get("args", []):
+            code, packed = _arg_code_and_bytes(arg)
+            if runs and runs[-1][0] == code and runs[-1][1] < 255:
+                runs[-1][1] += 1
+            else:
+                runs.append([code, 1])
+            payload.append(packed)
+        chunk = bytes(v for run in runs for v in run) + b"".join(payload)
+        table[i] = (message["frame"], message["type"], message["player_index"], len(runs), blob_size, len(chunk))
+        chunks.append(chunk)
+        blob_size += len(chunk)
+    return table, b"".join(chunks)
+
+def convert_json_file(input_file, output_file=None, level=3, dictionary=None):
+    if output_file is None:
+        output_file = input_file[:-len(".json.zst")] + EXTENSION if input_file.endswith(".json.zst") else input_file + EXTENSION
+    with open(input_file, "rb") as f:
+        data = json.loads(zstd_dict.decompress(f.read(), os.path.dirname(input_file)))
+    messages = data.get("messages", [])
+    table, arg_blob = messages_to_columns(messages)
+    return write_replay(output_file, data.get("header", {}), data.get("player_info", []), table, arg_blob, level, dictionary,
+                        summarize(build_player_index(messages)))
+
+def main():
+    folder = sys.argv[1] if len(sys.argv) > 1 else "."
+    json_files = glob.glob(os.path.join(folder, "*.json.zst"))
+    if not json_files:
+        print("No .json.zst files found.")
+        return
+    dictionary = zstd_dict.latest_dictionary(folder)
+    before = after = 0
+    for idx, input_file in enumerate(json_files, start=1):
+        try:
+            output_file = convert_json_file(input_file, dictionary=dictionary)
+        except Exception as e:
+            print(f"Error converting {input_file}: {e}")
+            continue
+        before += os.path.getsize(input_file)
+        after += os.path.getsize(output_file)
+        print(f"Converted file {idx}/{len(json_files)}: {output_file}")
+    print(f"Converted {len(json_files)} files: {before / 1024:.1f} KiB -> {after / 1024:.1f} KiB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+import os
+import time
+import hashlib
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# ----------------------------
+# Concurrent Replay Downloads
+# ----------------------------
+# One requests.Session whose connection pool is sized to the concurrency, so
+# downloads from the same host reuse kept-alive connections, driven by a
+# bounded thread pool. Content is returned as bytes; with a DownloadCache,
+# bodies are kept on disk and revalidated with conditional requests.
+FETCH_CONCURRENCY = 16
+FETCH_TIMEOUT = 10
+FETCH_RETRIES = 3
+FETCH_BACKOFF = 0.5 # Seconds before the first retry, doubled per attempt
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+RETRY_EXCEPTIONS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout, requests.exceptions.ChunkedEncodingError)
+
+class RetryableStatus(requests.exceptions.HTTPError):
+    pass
+
+class ReplayFetcher:
+    """
+    Downloads replays over a shared keep-alive session. fetch() gets one URL
+    with retries and exponential backoff (plus jitter) on connection errors,
+    timeouts and 429/5xx responses; fetch_all() runs up to `concurrency`
+    downloads at once and yields (url, content, error) as they finish.
+    With a cache (download_cache.DownloadCache), cached URLs are requested
+    with If-None-Match / If-Modified-Since and a 304 is served from disk.
+    Safe to share between threads.
+    """
+
+    def __init__(self, concurrency=FETCH_CONCURRENCY, timeout=FETCH_TIMEOUT, retries=FETCH_RETRIES, backoff=FETCH_BACKOFF, cache=None):
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.cache = cache
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.concurrency, pool_maxsize=self.concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.lock = threading.Lock()
+        self.downloads = 0
+        self.retried = 0
+        self.failures = 0
+        self.bytes = 0
+
+    def _get(self, url):
+        """Returns (content, from_cache)."""
+        entry = self.cache.lookup(url) if self.cache else None
+        if entry and self.cache.is_fresh(entry):
+            content = self.cache.read(url, entry)
+            if content is not None: return content, True
+        response = self.session.get(url, timeout=self.timeout, headers=self.cache.validators(entry) if entry else None)
+        if response.status_code == 304 and entry:
+            content = self.cache.read(url, entry, revalidated=True)
+            if content is not None: return content, True
+            response = self.session.get(url, timeout=self.timeout) # Blob went missing, fetch it in full
+        if response.status_code in RETRY_STATUSES:
+            raise RetryableStatus(f"{response.status_code} for url: {url}", response=response)
+        response.raise_for_status()
+        if self.cache:
+            self.cache.store(url, response.content, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+        return response.content, False
+
+    def fetch(self, url):
+        """Returns the body of `url`; raises the last requests exception once retries run out."""
+        for attempt in range(self.retries + 1):
+            try:
+                content, from_cache = self._get(url)
+                if not from_cache:
+                    with self.lock:
+                        self.downloads += 1
+                        self.bytes += len(content)
+                return content
+            except (RetryableStatus,) + RETRY_EXCEPTIONS:
+                if attempt == self.retries:
+                    with self.lock: self.failures += 1
+                    raise
+                with self.lock: self.retried += 1
+                time.sleep(self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+            except requests.exceptions.RequestException:
+                with self.lock: self.failures += 1
+                raise
+
+    def _fetch_result(self, url):
+        try:
+            return url, self.fetch(url), None
+        except requests.exceptions.RequestException as e:
+            return url, None, e
+
+    def fetch_all(self, urls):
+        """Yields (url, content, error) in completion order; at most 2x concurrency results are held at once."""
+        urls = iter(urls)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            pending = set()
+            for url in urls:
+                pending.add(executor.submit(self._fetch_result, url))
+                if len(pending) >= self.concurrency * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done: yield future.result()
+            for future in as_completed(pending):
+                yield future.result()
+
+    def report(self):
+        report = f"{self.downloads} downloaded ({self.bytes / 1e6:.1f} MB), {self.retried} retries, {self.failures} failed"
+        return report + (f"; cache: {self.cache.report()}" if self.cache else "")
+
+    def close(self):
+        self.session.close()
+        if self.cache: self.cache.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_default_fetcher = None
+_default_lock = threading.Lock()
+
+def get_default_fetcher(make_cache=None):
+    """Process-wide fetcher, so single downloads also reuse connections. make_cache() builds its cache on first use."""
+    global _default_fetcher
+    if _default_fetcher is None:
+        with _default_lock:
+            if _default_fetcher is None:
+                _default_fetcher = ReplayFetcher(cache=make_cache() if make_cache else None)
+    return _default_fetcher
+
+
+# ----------------------------
+# Local Stand-in Server
+# ----------------------------
+
+def serve_payloads(payloads, fail_first=(), drop_first=()):
+    """
+    Starts a keep-alive HTTP server on 127.0.0.1 serving payloads[path] as bytes,
+    with an ETag honoured by If-None-Match. Paths in fail_first answer 503 and
+    paths in drop_first close the connection on their first request. Returns
+    (server, base_url, seen) where `seen` records the client ports that
+    connected and how many full bodies were sent; call server.shutdown() when done.
+    """
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    failed = set(); dropped = set(); seen = {"ports": set(), "requests": 0, "bodies": 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            with lock:
+                seen["ports"].add(self.client_address[1]); seen["requests"] += 1
+                first_fail = self.path in fail_first and self.path not in failed
+                first_drop = self.path in drop_first and self.path not in dropped
+                if first_fail: failed.add(self.path)
+                if first_drop: dropped.add(self.path)
+            if first_drop:
+                self.close_connection = True
+                self.wfile.flush(); self.connection.shutdown(2)
+                return
+            body = payloads.get(self.path)
+            etag = f'"{hashlib.sha1(body).hexdigest()}"' if body is not None else None
+            status = 503 if first_fail else 404 if body is None else 304 if self.headers.get("If-None-Match") == etag else 200
+            body = body if status == 200 else b""
+            if status == 200:
+                with lock: seen["bodies"] += 1
+            self.send_response(status)
+            if etag: self.send_header("ETag", etag)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}", seen
+
+def verify_fetcher(count=200, concurrency=8, seed=0):
+    """Downloads `count` payloads from a local stand-in server with injected failures; returns the fetcher."""
+    rng = random.Random(seed)
+    payloads = {f"/{i}.rep": rng.randbytes(rng.randint(1, 200_000)) for i in range(count)}
+    paths = list(payloads)
+    server, base_url, seen = serve_payloads(payloads, fail_first=set(paths[::7]), drop_first=set(paths[3::11]))
+    try:
+        with ReplayFetcher(concurrency=concurrency, backoff=0.01) as fetcher:
+            results = {url: (content, error) for url, content, error in fetcher.fetch_all([base_url + p for p in paths] + [base_url + "/missing.rep"])}
+            for path, payload in payloads.items():
+                content, error = results[base_url + path]
+                if error is not None or content != payload:
+                    raise AssertionError(f"{path}: {error or 'content differs'}")
+            if results[base_url + "/missing.rep"][1] is None:
+                raise AssertionError("/missing.rep: expected a 404 error")
+            if len(seen["ports"]) >= seen["requests"]:
+                raise AssertionError("connections were not reused")
+        return fetcher, seen
+    finally:
+        server.shutdown()
+
+def verify_cache(cache_dir, count=100, concurrency=8, seed=0):
+    """Fetches `count` payloads twice through a DownloadCache; the second pass must be all 304s, then checks eviction."""
+    from download_cache import DownloadCache
+    rng = random.Random(seed)
+    payloads = {f"/{i}.rep": rng.randbytes(rng.randint(1, 200_000)) for i in range(count)}
+    payloads["/copy.rep"] = payloads["/0.rep"] # Same content under another URL shares one blob
+    urls_for = lambda base_url: [base_url + p for p in payloads]
+    server, base_url, seen = serve_payloads(payloads)
+    try:
+        with ReplayFetcher(concurrency=concurrency, cache=DownloadCache(cache_dir)) as fetcher:
+            first = {url: content for url, content, _ in fetcher.fetch_all(urls_for(base_url))}
+            bodies = seen["bodies"]
+            second = {url: content for url, content, _ in fetcher.fetch_all(urls_for(base_url))}
+            if second != first or first != {base_url + p: c for p, c in payloads.items()}:
+                raise AssertionError("cached content differs")
+            if seen["bodies"] != bodies:
+                raise AssertionError(f"{seen['bodies'] - bodies} bodies downloaded again")
+            stats = fetcher.cache.stats()
+            if stats["bytes"] != sum(len(c) for p, c in payloads.items() if p != "/copy.rep"):
+                raise AssertionError(f"cache holds {stats['bytes']} bytes")
+            fetcher.cache.max_bytes = stats["bytes"] // 2
+            fetcher.cache.evict()
+            stats = fetcher.cache.stats()
+            blobs = sum(len(files) for _, _, files in os.walk(os.path.join(cache_dir, "blobs")))
+            if stats["bytes"] > stats["max_bytes"] or blobs >= count or stats["entries"] >= count:
+                raise AssertionError(f"eviction left {stats['entries']} entries, {blobs} blobs, {stats['bytes']} bytes")
+        return fetcher, stats
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    import sys
+    start = time.perf_counter()
+    if len(sys.argv) > 1:
+        # python replay_fetch.py <url>... : download and report sizes, nothing is saved
+        with ReplayFetcher() as fetcher:
+            for url, content, error in fetcher.fetch_all(sys.argv[1:]):
+                print(f"{url}: {error if error else f'{len(content)} bytes'}")
+        print(f"{fetcher.report()} in {time.perf_counter() - start:.2f}s")
+    else:
+        import tempfile
+        fetcher, seen = verify_fetcher()
+        print(f"Stand-in server check passed ({len(seen['ports'])} connections for {seen['requests']} requests; {fetcher.report()})")
+        with tempfile.TemporaryDirectory() as cache_dir:
+            fetcher, stats = verify_cache(cache_dir)
+        print(f"Download cache check passed ({stats['hits']} hits, {stats['bytes_saved'] / 1e6:.1f} MB saved, {stats['entries']} entries left after eviction)")
+        print(f"Done in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,86 @@
+from replay_reader import probe_header
+
+# ----------------------------
+# Header-Only Replay Filters
+# ----------------------------
+# A filter is a callable taking the parsed header dict and returning None to
+# keep the replay or a short reason string (used as the skip status) to drop
+# it. probe_replay runs a chain of them on a header read from the first few
+# hundred bytes, so rejected replays never have their messages read.
+
+def game_option(game_options, key):
+    for part in game_options.split(";"):
+        if part.startswith(key + "="):
+            return part[len(key) + 1:]
+    return None
+
+def slot_summary(game_options):
+    """Returns (slot type, team) for every occupied slot in S=; type is 'H' (human) or 'C' (AI)."""
+    slots = []
+    for entry in (game_option(game_options, "S") or "").split(":"):
+        entry = entry.strip()
+        if not entry or entry[0] not in ("H", "C"):
+            continue
+        tokens = entry.split(",")
+        try:
+            template = int(tokens[-4] if entry[0] == "H" else tokens[2])
+            team = int(tokens[-2] if entry[0] == "H" else tokens[4])
+        except (IndexError, ValueError):
+            template, team = -1, -1
+        if template == -2:
+            continue # Observer
+        slots.append((entry[0], team))
+    return slots
+
+def match_type(game_options):
+    """Match type from the slot teams, e.g. '1v1' or '2v2'; players without a team count as their own team."""
+    sizes = {}
+    for i, (_, team) in enumerate(slot_summary(game_options)):
+        key = team if team >= 0 else f"solo{i}"
+        sizes[key] = sizes.get(key, 0) + 1
+    return "v".join(str(n) for n in sorted(sizes.values())) if sizes else "Unknown"
+
+def version_filter(valid_versions):
+    def check(header):
+        if header.get("version_string", "").strip() not in valid_versions:
+            return "invalid_version"
+    return check
+
+def min_duration_filter(min_frames):
+    def check(header):
+        if header.get("frame_duration", 0) < min_frames:
+            return "low_duration"
+    return check
+
+def match_type_filter(match_types):
+    match_types = set(match_types)
+    def check(header):
+        if match_type(header.get("game_options", "")) not in match_types:
+            return "match_type"
+    return check
+
+def no_ai_filter():
+    def check(header):
+        if any(slot_type == "C" for slot_type, _ in slot_summary(header.get("game_options", ""))):
+            return "ai_present"
+    return check
+
+def map_filter(allowed_maps):
+    allowed = {m.lower() for m in allowed_maps}
+    def check(header):
+        map_path = game_option(header.get("game_options", ""), "M") or ""
+        if map_path.split("/")[-1].strip().lower() not in allowed:
+            return "map"
+    return check
+
+def apply_filters(header, filters):
+    for check in filters:
+        reason = check(header)
+        if reason:
+            return reason
+    return None
+
+def probe_replay(file_path, filters):
+    """Returns (header, reason); reason is None when every filter keeps the replay."""
+    header = probe_header(file_path)
+    return header, apply_filters(header, filters)
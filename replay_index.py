@@ -0,0 +1,126 @@
+import os
+import json
+import hashlib
+import sqlite3
+
+# Bump when a cached stage result would change shape or meaning, so old
+# entries are dropped instead of being reused.
+INDEX_VERSION = 2
+INDEX_FILE = "replay_index.db"
+
+def file_hash(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+class ReplayIndex:
+    """
+    Persistent per-file cache of stage results (e.g. the Pass 1 match key and
+    the Pass 2 replay result), keyed by stage + path and validated against the
+    file's size and mtime. With use_hash=True a changed mtime falls back to a
+    content hash, so touched-but-identical files still hit.
+
+    All rows are loaded at open; writes are buffered and flushed in batches.
+    """
+
+    def __init__(self, db_file=INDEX_FILE, use_hash=False, batch_size=1000):
+        self.use_hash = use_hash
+        self.batch_size = batch_size
+        self.conn = sqlite3.connect(db_file)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS index_meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                stage TEXT NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                content_hash TEXT,
+                value TEXT,
+                PRIMARY KEY (stage, path)
+            )
+        """)
+        row = self.conn.execute("SELECT value FROM index_meta WHERE key = 'version'").fetchone()
+        with self.conn:
+            if row is None or int(row[0]) != INDEX_VERSION:
+                self.conn.execute("DELETE FROM entries")
+                self.conn.execute("INSERT OR REPLACE INTO index_meta VALUES ('version', ?)", (str(INDEX_VERSION),))
+        self.entries = {(stage, path): [size, mtime_ns, content_hash, value]
+                        for stage, path, size, mtime_ns, content_hash, value in self.conn.execute("SELECT * FROM entries")}
+        self.pending = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _fingerprint(self, path):
+        st = os.stat(path)
+        return st.st_size, st.st_mtime_ns
+
+    def get(self, stage, path):
+        """Returns (hit, value); hit is False when the file is new, changed or gone."""
+        entry = self.entries.get((stage, path))
+        if entry is None:
+            self.misses += 1
+            return False, None
+        try:
+            size, mtime_ns = self._fingerprint(path)
+        except OSError:
+            self.misses += 1
+            return False, None
+        if size != entry[0]:
+            self.misses += 1
+            return False, None
+        if mtime_ns != entry[1]:
+            if not (self.use_hash and entry[2] and file_hash(path) == entry[2]):
+                self.misses += 1
+                return False, None
+            entry[1] = mtime_ns
+            self.pending[(stage, path)] = entry
+        self.hits += 1
+        return True, json.loads(entry[3])
+
+    def put(self, stage, path, value):
+        try:
+            size, mtime_ns = self._fingerprint(path)
+        except OSError:
+            return
+        content_hash = file_hash(path) if self.use_hash else None
+        entry = [size, mtime_ns, content_hash, json.dumps(value)]
+        self.entries[(stage, path)] = entry
+        self.pending[(stage, path)] = entry
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def forget(self, paths):
+        paths = set(paths)
+        keys = [key for key in self.entries if key[1] in paths]
+        for key in keys:
+            del self.entries[key]
+            self.pending.pop(key, None)
+        if keys:
+            with self.conn:
+                self.conn.executemany("DELETE FROM entries WHERE stage = ? AND path = ?", keys)
+
+    def prune(self, existing_paths):
+        """Drops entries for files that are no longer on disk."""
+        existing_paths = set(existing_paths)
+        self.forget({path for _, path in self.entries if path not in existing_paths})
+
+    def flush(self):
+        if not self.pending:
+            return
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                                  [(stage, path, *entry) for (stage, path), entry in self.pending.items()])
+        self.pending.clear()
+
+    def report(self):
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0.0
+        return f"{self.hits} cached, {self.misses} parsed ({rate:.1f}% reused)"
+
+    def close(self):
+        self.flush()
+        self.conn.close()
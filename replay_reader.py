@@ -0,0 +1,570 @@
+import os
+import mmap
+import struct
+from bisect import bisect_left
+from array import array
+from collections import OrderedDict
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+# ----------------------------
+# Replay Format Tables
+# ----------------------------
+MAX_SLOTS = 8
+
+ARG_TYPE_MAP = {
+    0: ('i', 4),
+    1: ('f', 4),
+    2: ('?', 1),
+    3: ('I', 4),
+    4: ('I', 4),
+    5: ('I', 4),
+    6: ('fff', 12),
+    7: ('ii', 8),
+    8: ('iiii', 16),
+    9: ('I', 4),
+    10: ('H', 2),
+}
+
+MESSAGE_TYPE_MAP = {
+    1000: "MSG_BEGIN_NETWORK_MESSAGES",
+    1001: "MSG_CREATE_SELECTED_GROUP",
+    1002: "MSG_CREATE_SELECTED_GROUP_NO_SOUND",
+    1003: "MSG_DESTROY_SELECTED_GROUP",
+    1004: "MSG_REMOVE_FROM_SELECTED_GROUP",
+    1005: "MSG_SELECTED_GROUP_COMMAND",
+    1006: "MSG_CREATE_TEAM0",
+    1007: "MSG_CREATE_TEAM1",
+    1008: "MSG_CREATE_TEAM2",
+    1009: "MSG_CREATE_TEAM3",
+    1010: "MSG_CREATE_TEAM4",
+    1011: "MSG_CREATE_TEAM5",
+    1012: "MSG_CREATE_TEAM6",
+    1013: "MSG_CREATE_TEAM7",
+    1014: "MSG_CREATE_TEAM8",
+    1015: "MSG_CREATE_TEAM9",
+    1016: "MSG_SELECT_TEAM0",
+    1017: "MSG_SELECT_TEAM1",
+    1018: "MSG_SELECT_TEAM2",
+    1019: "MSG_SELECT_TEAM3",
+    1020: "MSG_SELECT_TEAM4",
+    1021: "MSG_SELECT_TEAM5",
+    1022: "MSG_SELECT_TEAM6",
+    1023: "MSG_SELECT_TEAM7",
+    1024: "MSG_SELECT_TEAM8",
+    1025: "MSG_SELECT_TEAM9",
+    1026: "MSG_ADD_TEAM0",
+    1027: "MSG_ADD_TEAM1",
+    1028: "MSG_ADD_TEAM2",
+    1029: "MSG_ADD_TEAM3",
+    1030: "MSG_ADD_TEAM4",
+    1031: "MSG_ADD_TEAM5",
+    1032: "MSG_ADD_TEAM6",
+    1033: "MSG_ADD_TEAM7",
+    1034: "MSG_ADD_TEAM8",
+    1035: "MSG_ADD_TEAM9",
+    1036: "MSG_DO_ATTACKSQUAD",
+    1037: "MSG_DO_WEAPON",
+    1038: "MSG_DO_WEAPON_AT_LOCATION",
+    1039: "MSG_DO_WEAPON_AT_OBJECT",
+    1040: "MSG_DO_SPECIAL_POWER",
+    1041: "MSG_DO_SPECIAL_POWER_AT_LOCATION",
+    1042: "MSG_DO_SPECIAL_POWER_AT_OBJECT",
+    1043: "MSG_SET_RALLY_POINT",
+    1044: "MSG_PURCHASE_SCIENCE",
+    1045: "MSG_QUEUE_UPGRADE",
+    1046: "MSG_CANCEL_UPGRADE",
+    1047: "MSG_QUEUE_UNIT_CREATE",
+    1048: "MSG_CANCEL_UNIT_CREATE",
+    1049: "MSG_DOZER_CONSTRUCT",
+    1050: "MSG_DOZER_CONSTRUCT_LINE",
+    1051: "MSG_DOZER_CANCEL_CONSTRUCT",
+    1052: "MSG_SELL",
+    1053: "MSG_EXIT",
+    1054: "MSG_EVACUATE",
+    1055: "MSG_EXECUTE_RAILED_TRANSPORT",
+    1056: "MSG_COMBATDROP_AT_LOCATION",
+    1057: "MSG_COMBATDROP_AT_OBJECT",
+    1058: "MSG_AREA_SELECTION",
+    1059: "MSG_DO_ATTACK_OBJECT",
+    1060: "MSG_DO_FORCE_ATTACK_OBJECT",
+    1061: "MSG_DO_FORCE_ATTACK_GROUND",
+    1062: "MSG_GET_REPAIRED",
+    1063: "MSG_GET_HEALED",
+    1064: "MSG_DO_REPAIR",
+    1065: "MSG_RESUME_CONSTRUCTION",
+    1066: "MSG_ENTER",
+    1067: "MSG_DOCK",
+    1068: "MSG_DO_MOVETO",
+    1069: "MSG_DO_ATTACKMOVETO",
+    1070: "MSG_DO_FORCEMOVETO",
+    1071: "MSG_ADD_WAYPOINT",
+    1072: "MSG_DO_GUARD_POSITION",
+    1073: "MSG_DO_GUARD_OBJECT",
+    1074: "MSG_DO_STOP",
+    1075: "MSG_DO_SCATTER",
+    1076: "MSG_INTERNET_HACK",
+    1077: "MSG_DO_CHEER",
+    1078: "MSG_TOGGLE_OVERCHARGE",
+    1079: "MSG_SWITCH_WEAPONS",
+    1080: "MSG_CONVERT_TO_CARBOMB",
+    1081: "MSG_CAPTUREBUILDING",
+    1082: "MSG_DISABLEVEHICLE_HACK",
+    1083: "MSG_STEALCASH_HACK",
+    1084: "MSG_DISABLEBUILDING_HACK",
+    1085: "MSG_SNIPE_VEHICLE",
+    1086: "MSG_DO_SPECIAL_POWER_OVERRIDE_DESTINATION",
+    1087: "MSG_DO_SALVAGE",
+    1088: "MSG_CLEAR_INGAME_POPUP_MESSAGE",
+    1089: "MSG_PLACE_BEACON",
+    1090: "MSG_REMOVE_BEACON",
+    1091: "MSG_SET_BEACON_TEXT",
+    1092: "MSG_SET_REPLAY_CAMERA",
+    1093: "MSG_SELF_DESTRUCT",
+    1094: "MSG_CREATE_FORMATION",
+    1095: "MSG_LOGIC_CRC",
+    1096: "MSG_SET_MINE_CLEARING_DETAIL",
+    1097: "MSG_ENABLE_RETALIATION_MODE",
+}
+
+# ----------------------------
+# Precompiled Structs
+# ----------------------------
+HEADER_TIMES = struct.Struct('<III')
+HEADER_FLAGS = struct.Struct(f'<BB{MAX_SLOTS}B')
+HEADER_VERSION = struct.Struct('<III')
+HEADER_TRAILER = struct.Struct('<iiii')
+MESSAGE_HEAD = struct.Struct('<IiiB')
+
+# ----------------------------
+# Per-Signature Argument Decoders
+# ----------------------------
+class ArgumentDecoder:
+    """One compiled struct for a whole argument block plus the per-argument value widths."""
+
+    def __init__(self, signature):
+        fmt = ""
+        widths = []
+        for i in range(0, len(signature), 2):
+            arg_type, arg_count = signature[i], signature[i + 1]
+            fmt_size = ARG_TYPE_MAP.get(arg_type)
+            if fmt_size is None:
+                raise ValueError(f"Unknown argument type: {arg_type}")
+            fmt += fmt_size[0] * arg_count
+            widths.extend([len(fmt_size[0])] * arg_count)
+        self.struct = struct.Struct(f'<{fmt}')
+        self.size = self.struct.size
+        self.widths = None if all(w == 1 for w in widths) else widths
+
+    def decode(self, data, pos):
+        values = self.struct.unpack_from(data, pos)
+        if self.widths is None:
+            return list(values)
+        args = []
+        i = 0
+        for width in self.widths:
+            args.append(values[i] if width == 1 else values[i:i + width])
+            i += width
+        return args
+
+class DecoderCache:
+    """LRU cache of ArgumentDecoders keyed by the raw (type, count) signature bytes."""
+
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self.decoders = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, signature):
+        # No lock on this hot path: each dict operation is atomic, and when
+        # threads race on eviction the worst case is a rebuilt decoder.
+        decoder = self.decoders.get(signature)
+        if decoder is not None:
+            self.hits += 1
+            try:
+                self.decoders.move_to_end(signature)
+            except KeyError:
+                pass
+            return decoder
+        self.misses += 1
+        decoder = ArgumentDecoder(signature)
+        self.decoders[signature] = decoder
+        if len(self.decoders) > self.max_size:
+            try:
+                self.decoders.popitem(last=False)
+            except KeyError:
+                pass
+        return decoder
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.decoders), 'max_size': self.max_size}
+
+    def clear(self):
+        self.decoders.clear()
+        self.hits = 0
+        self.misses = 0
+
+DECODER_CACHE = DecoderCache()
+
+# ----------------------------
+# Buffer-Backed Reader
+# ----------------------------
+class ReplayBuffer:
+    """Cursor over an in-memory replay that decodes fields with unpack_from at offsets."""
+
+    def __init__(self, data, pos=0):
+        self.data = data
+        self.pos = pos
+
+    def __len__(self):
+        return len(self.data)
+
+    def unpack(self, st):
+        values = st.unpack_from(self.data, self.pos)
+        self.pos += st.size
+        return values
+
+    def read_bytes(self, size):
+        chunk = self.data[self.pos:self.pos + size]
+        self.pos += len(chunk)
+        return bytes(chunk)
+
+    def read_ascii_string(self):
+        end = self.data.find(b'\x00', self.pos)
+        if end == -1:
+            end = len(self.data)
+        raw = self.data[self.pos:end]
+        self.pos = min(end + 1, len(self.data))
+        return bytes(raw).decode('utf-8', errors='replace')
+
+    def read_unicode_string(self):
+        # The terminator has to sit on a UTF-16 code unit boundary, so skip
+        # matches that straddle two characters (e.g. "A\u0100" is 41 00 00 01).
+        end = self.data.find(b'\x00\x00', self.pos)
+        while end != -1 and (end - self.pos) % 2:
+            end = self.data.find(b'\x00\x00', end + 1)
+        if end == -1:
+            end = len(self.data)
+        raw = self.data[self.pos:end]
+        self.pos = min(end + 2, len(self.data))
+        return bytes(raw).decode('utf-16-le')
+
+def read_replay_bytes(file_path):
+    with open(file_path, 'rb') as f:
+        return f.read()
+
+def parse_header(buf):
+    identifier = buf.read_bytes(6).decode('ascii')
+    if identifier != "GENREP":
+        raise ValueError("Not a valid .rep file: missing GENREP identifier")
+    start_time, end_time, frame_duration = buf.unpack(HEADER_TIMES)
+    flags = buf.unpack(HEADER_FLAGS)
+    desync_game, quit_early = flags[0], flags[1]
+    player_discons = list(flags[2:])
+    replay_name = buf.read_unicode_string()
+    system_time = buf.read_bytes(16)
+    version_string = buf.read_unicode_string()
+    version_time_string = buf.read_unicode_string()
+    version_number, exe_crc, ini_crc = buf.unpack(HEADER_VERSION)
+    game_options = buf.read_ascii_string()
+    local_player_index_str = buf.read_ascii_string()
+    local_player_index = int(local_player_index_str) if local_player_index_str else -1
+    difficulty, original_game_mode, rank_points, max_fps = buf.unpack(HEADER_TRAILER)
+    return {
+        'start_time': start_time,
+        'end_time': end_time,
+        'frame_duration': frame_duration,
+        'desync_game': desync_game,
+        'quit_early': quit_early,
+        'player_discons': player_discons,
+        'replay_name': replay_name,
+        'system_time': system_time.hex(),
+        'version_string': version_string,
+        'version_time_string': version_time_string,
+        'version_number': version_number,
+        'exe_crc': exe_crc,
+        'ini_crc': ini_crc,
+        'game_options': game_options,
+        'local_player_index': local_player_index,
+        'difficulty': difficulty,
+        'original_game_mode': original_game_mode,
+        'rank_points': rank_points,
+        'max_fps': max_fps
+    }
+
+def parse_game_message(data, pos, decoders=DECODER_CACHE):
+    frame, msg_type, player_index, num_types = MESSAGE_HEAD.unpack_from(data, pos)
+    pos += MESSAGE_HEAD.size
+    sig_end = pos + 2 * num_types
+    if sig_end > len(data):
+        raise ValueError("Unexpected end of file while reading argument types")
+    decoder = decoders.get(data[pos:sig_end])
+    if sig_end + decoder.size > len(data):
+        raise ValueError("Unexpected end of file while reading arguments")
+    args = decoder.decode(data, sig_end)
+    message = {
+        "frame": frame,
+        "type": msg_type,
+        "type_text": MESSAGE_TYPE_MAP.get(msg_type, f"Unknown ({msg_type})"),
+        "player_index": player_index,
+        "args": args
+    }
+    return message, sig_end + decoder.size
+
+def iter_game_messages(data, pos, file_path="", decoders=DECODER_CACHE):
+    msg_index = 0
+    file_size = len(data)
+    while pos + MESSAGE_HEAD.size <= file_size:
+        try:
+            msg_index += 1
+            message, pos = parse_game_message(data, pos, decoders)
+        except Exception as e:
+            print(f"Error parsing message {msg_index} in {file_path}: {e}")
+            return
+        yield message
+
+def parse_messages(data, pos, file_path="", decoders=DECODER_CACHE):
+    return list(iter_game_messages(data, pos, file_path, decoders))
+
+# ----------------------------
+# Columnar Message Table (NumPy)
+# ----------------------------
+if NUMPY_AVAILABLE:
+    MESSAGE_DTYPE = np.dtype([
+        ('frame', '<u4'),
+        ('type', '<i2'),
+        ('player', 'i1'),
+        ('num_types', 'u1'),
+        ('arg_offset', '<u4'),
+        ('arg_len', '<u4'),
+    ])
+
+def parse_messages_columnar(data, pos, file_path="", decoders=DECODER_CACHE):
+    """Frames messages without decoding arguments: returns (structured array, argument blob).
+
+    Each row's arg_offset/arg_len point at the message's raw signature and argument
+    bytes inside the blob; decode them with columnar_message_args.
+    """
+    if not NUMPY_AVAILABLE:
+        raise ImportError("numpy is required for columnar message output")
+    frames = array('I'); types = array('i'); players = array('i'); num_types_col = array('B')
+    offsets = array('I'); lengths = array('I')
+    chunks = []
+    blob_size = 0
+    msg_index = 0
+    file_size = len(data)
+    while pos + MESSAGE_HEAD.size <= file_size:
+        msg_index += 1
+        try:
+            frame, msg_type, player_index, num_types = MESSAGE_HEAD.unpack_from(data, pos)
+            sig_start = pos + MESSAGE_HEAD.size
+            sig_end = sig_start + 2 * num_types
+            if sig_end > file_size:
+                raise ValueError("Unexpected end of file while reading argument types")
+            end = sig_end + decoders.get(data[sig_start:sig_end]).size
+            if end > file_size:
+                raise ValueError("Unexpected end of file while reading arguments")
+        except Exception as e:
+            print(f"Error parsing message {msg_index} in {file_path}: {e}")
+            break
+        frames.append(frame); types.append(msg_type); players.append(player_index); num_types_col.append(num_types)
+        offsets.append(blob_size); lengths.append(end - sig_start)
+        chunks.append(data[sig_start:end])
+        blob_size += end - sig_start
+        pos = end
+    table = np.empty(len(frames), dtype=MESSAGE_DTYPE)
+    table['frame'] = np.asarray(frames)
+    table['type'] = np.asarray(types).astype('<i2')
+    table['player'] = np.asarray(players).astype('i1')
+    table['num_types'] = np.asarray(num_types_col)
+    table['arg_offset'] = np.asarray(offsets)
+    table['arg_len'] = np.asarray(lengths)
+    return table, b''.join(chunks)
+
+def columnar_message_args(table, arg_blob, index, decoders=DECODER_CACHE):
+    offset = int(table['arg_offset'][index])
+    sig_end = offset + 2 * int(table['num_types'][index])
+    return decoders.get(arg_blob[offset:sig_end]).decode(arg_blob, sig_end)
+
+def columnar_to_messages(table, arg_blob, decoders=DECODER_CACHE):
+    """Expands a columnar table back into the list-of-dicts message format."""
+    messages = []
+    for i, (frame, msg_type, player_index) in enumerate(zip(table['frame'].tolist(), table['type'].tolist(), table['player'].tolist())):
+        messages.append({
+            "frame": frame,
+            "type": msg_type,
+            "type_text": MESSAGE_TYPE_MAP.get(msg_type, f"Unknown ({msg_type})"),
+            "player_index": player_index,
+            "args": columnar_message_args(table, arg_blob, i, decoders)
+        })
+    return messages
+
+# ----------------------------
+# Replay Timeline
+# ----------------------------
+MSG_END_GAME = 27
+MSG_SELF_DESTRUCT = 1093
+MSG_LOGIC_CRC = 1095
+QUIT_SIGNATURE = b'\x02\x01' # (bool, 1)
+CRC_SIGNATURE = b'\x00\x01\x02\x01' # (int, 1), (bool, 1)
+CRC_VALUE = struct.Struct('<I')
+
+# Messages the game sends on its own (CRCs, quits, end of game) or that only
+# change the selection; they do not count as player activity.
+NON_ACTION_TYPES = frozenset({MSG_END_GAME, MSG_SELF_DESTRUCT, MSG_LOGIC_CRC, 1097, 1001, 1003, 1058, *range(1016, 1026)})
+
+class ReplayTimeline:
+    """
+    Per-player quit, CRC and activity data gathered in one pass over the framed
+    message stream (see scan_timeline).
+
+    Positions are byte offsets of a message's type field in the scanned data, so
+    they order like the messages do; frame_at maps a recorded position to its frame.
+    """
+
+    def __init__(self):
+        self.message_count = 0
+        self.frames = {}          # position -> frame, for every recorded message
+        self.quits = {}           # player -> [position] of quit messages
+        self.crc_positions = {}   # player -> [position] of logic CRC messages
+        self.crcs_by_frame = {}   # frame -> {player: (position, crc)}, last CRC per player in that frame
+        self.last_crc = {}        # player -> position of the player's last CRC
+        self.last_action = {}     # player -> position of the last message not in NON_ACTION_TYPES
+        self.first_crc_frame = None
+        self.end_player = None    # sender of a trailing end-of-game message, if any
+        self.truncated = False    # stopped at a message that could not be framed
+
+    def frame_at(self, position):
+        return self.frames.get(position, 0)
+
+    def first_crc_players(self):
+        """Players that sent a CRC in the first frame any CRC was sent, lowest first."""
+        return sorted(self.crcs_by_frame.get(self.first_crc_frame, ()))
+
+    def crcs_at(self, frame):
+        return self.crcs_by_frame.get(frame, {})
+
+    def next_crc(self, player, after):
+        """Position of player's first CRC after position `after`, or -1."""
+        positions = self.crc_positions.get(player, [])
+        i = bisect_left(positions, after)
+        return positions[i] if i < len(positions) else -1
+
+def scan_timeline(data, pos=0, decoders=DECODER_CACHE):
+    """Builds a ReplayTimeline from the message stream starting at pos.
+
+    Messages are framed by their argument signatures, so nothing can match
+    across message boundaries; only CRC values are decoded.
+    """
+    timeline = ReplayTimeline()
+    frames = timeline.frames; quits = timeline.quits; crc_positions = timeline.crc_positions
+    crcs_by_frame = timeline.crcs_by_frame; last_crc = timeline.last_crc; last_action = {}
+    sizes = {}
+    unpack_head = MESSAGE_HEAD.unpack_from; head_size = MESSAGE_HEAD.size
+    file_size = len(data); count = 0
+    msg_type = num_types = player = None
+    while pos + head_size <= file_size:
+        frame, msg_type, player, num_types = unpack_head(data, pos)
+        sig_start = pos + head_size
+        sig_end = sig_start + 2 * num_types
+        if sig_end > file_size:
+            timeline.truncated = True; break
+        signature = data[sig_start:sig_end]
+        size = sizes.get(signature)
+        if size is None:
+            try: size = sizes[signature] = decoders.get(signature).size
+            except ValueError: timeline.truncated = True; break
+        end = sig_end + size
+        if end > file_size:
+            timeline.truncated = True; break
+        position = pos + 4
+        if msg_type == MSG_LOGIC_CRC:
+            if signature == CRC_SIGNATURE:
+                crc = CRC_VALUE.unpack_from(data, sig_end)[0]
+                frames[position] = frame
+                crc_positions.setdefault(player, []).append(position)
+                crcs_by_frame.setdefault(frame, {})[player] = (position, crc)
+                last_crc[player] = position
+                if timeline.first_crc_frame is None: timeline.first_crc_frame = frame
+        elif msg_type == MSG_SELF_DESTRUCT:
+            if signature == QUIT_SIGNATURE:
+                frames[position] = frame
+                quits.setdefault(player, []).append(position)
+        elif msg_type not in NON_ACTION_TYPES:
+            last_action[player] = (position, frame)
+        count += 1
+        pos = end
+    if count and msg_type == MSG_END_GAME and num_types == 0 and not timeline.truncated:
+        timeline.end_player = player
+    for player, (position, frame) in last_action.items():
+        frames[position] = frame
+        timeline.last_action[player] = position
+    timeline.message_count = count
+    return timeline
+
+# ----------------------------
+# Whole-File Entry Points
+# ----------------------------
+def parse_rep_bytes(data, file_path="", columnar=False):
+    buf = ReplayBuffer(data)
+    header = parse_header(buf)
+    if columnar:
+        messages, arg_blob = parse_messages_columnar(data, buf.pos, file_path)
+        return {'header': header, 'messages': messages, 'arg_blob': arg_blob}
+    messages = parse_messages(data, buf.pos, file_path)
+    return {'header': header, 'messages': messages}
+
+def map_replay_file(f):
+    """Memory-maps an open replay; pages are only read as the parser touches them."""
+    if os.fstat(f.fileno()).st_size == 0:
+        raise ValueError("Not a valid .rep file: missing GENREP identifier")
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def read_header(file_path):
+    """Parses only the replay header; the message stream is never read."""
+    with open(file_path, 'rb') as f, map_replay_file(f) as data:
+        return parse_header(ReplayBuffer(data))
+
+PROBE_SIZE = 1024
+
+def probe_header(file_path, probe_size=PROBE_SIZE):
+    """Parses the header from the first probe_size bytes of the file.
+
+    Reads more (doubling) only when the header runs past what was read, so a
+    typical replay costs one small read however long its message stream is.
+    """
+    with open(file_path, 'rb') as f:
+        data = f.read(max(probe_size, 64))
+        while True:
+            try:
+                return parse_header(ReplayBuffer(data))
+            except (struct.error, UnicodeDecodeError) as e:
+                # A header cut short fails in a later unpack, or mid UTF-16 character
+                more = f.read(max(len(data), probe_size))
+                if not more:
+                    raise ValueError("Not a valid .rep file: truncated header") from e
+                data += more
+
+def iter_messages(file_path, decoders=DECODER_CACHE):
+    """Yields messages lazily from a memory-mapped replay.
+
+    Nothing is materialized, so memory stays constant in replay length and
+    callers can stop early; the file is closed when the generator is.
+    """
+    with open(file_path, 'rb') as f, map_replay_file(f) as data:
+        buf = ReplayBuffer(data)
+        parse_header(buf)
+        yield from iter_game_messages(data, buf.pos, file_path, decoders)
+
+def parse_rep_file(file_path, columnar=False):
+    """Reads the whole replay in one call and decodes it from memory.
+
+    With columnar=True, 'messages' is a MESSAGE_DTYPE array and 'arg_blob' holds the
+    raw argument bytes it indexes into, instead of a list of per-message dicts.
+    """
+    return parse_rep_bytes(read_replay_bytes(file_path), file_path, columnar)
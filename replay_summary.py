@@ -0,0 +1,127 @@
+import os
+import json
+
+from replay_reader import MSG_SELF_DESTRUCT
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# ----------------------------
+# Per-Player Message Index
+# ----------------------------
+# Built in one pass per replay; winner detection, the attack-object check and
+# the action count all read from it instead of rescanning the messages.
+MSG_DO_ATTACK_OBJECT = 1059
+
+def build_player_index(messages):
+    """
+    Returns {"players": {player_index: {message type: [count, first frame, last frame]}},
+    "player_actions": {player_index: message count}, "actions": number of
+    messages that carry a player_index}.
+    """
+    players = {}
+    player_actions = {}
+    actions = 0
+    for m in messages:
+        player = m.get("player_index")
+        if player is None:
+            continue
+        actions += 1
+        player_actions[player] = player_actions.get(player, 0) + 1
+        frame = m.get("frame", 0)
+        by_type = players.get(player)
+        if by_type is None:
+            by_type = players[player] = {}
+        msg_type = m.get("type")
+        types = (msg_type,)
+        if m.get("type_text") == "MSG_SELF_DESTRUCT" and msg_type != MSG_SELF_DESTRUCT:
+            types = (msg_type, MSG_SELF_DESTRUCT) # A self-destruct is also recognised by its type_text alone
+        for msg_type in types:
+            entry = by_type.get(msg_type)
+            if entry is None:
+                by_type[msg_type] = [1, frame, frame]
+            else:
+                entry[0] += 1
+                if frame < entry[1]: entry[1] = frame
+                if frame > entry[2]: entry[2] = frame
+    return {"players": players, "player_actions": player_actions, "actions": actions}
+
+def build_player_index_from_columns(frames, types, players):
+    """build_player_index for .rcol columns, grouped with NumPy instead of a Python loop."""
+    if len(frames) == 0:
+        return {"players": {}, "player_actions": {}, "actions": 0}
+    keys = (players.astype(np.int64) << 16) | (types.astype(np.int64) & 0xFFFF)
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]; frames = frames[order].astype(np.int64)
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    counts = np.diff(np.r_[starts, len(keys)])
+    firsts = np.minimum.reduceat(frames, starts); lasts = np.maximum.reduceat(frames, starts)
+    index = {}
+    player_actions = {}
+    for player, msg_type, count, first, last in zip(players[order][starts].tolist(), types[order][starts].tolist(),
+                                                     counts.tolist(), firsts.tolist(), lasts.tolist()):
+        index.setdefault(player, {})[msg_type] = [count, first, last]
+        player_actions[player] = player_actions.get(player, 0) + count
+    return {"players": index, "player_actions": player_actions, "actions": len(frames)}
+
+def message_stats(index, player_index, msg_type):
+    """[count, first frame, last frame] for one player and message type, or None."""
+    return index["players"].get(player_index, {}).get(msg_type)
+
+# ----------------------------
+# Replay Summaries
+# ----------------------------
+# The few facts check_winner needs, written by parse.py next to the messages so
+# analyses never decode them: the player index cut down to SUMMARY_TYPES plus
+# the action counts. .rcol files keep it in their metadata block (read_meta);
+# .json.zst outputs get a <name>.summary.json sidecar that also holds the
+# header and player_info. Bump SUMMARY_VERSION when the facts change, so stale
+# summaries are recomputed from the messages instead of being trusted.
+SUMMARY_VERSION = 1
+SUMMARY_EXTENSION = ".summary.json"
+SUMMARY_TYPES = (MSG_SELF_DESTRUCT, MSG_DO_ATTACK_OBJECT)
+
+def summarize(index, types=SUMMARY_TYPES):
+    players = []
+    for player, by_type in sorted(index["players"].items()):
+        kept = [[msg_type] + by_type[msg_type] for msg_type in types if msg_type in by_type]
+        players.append([player, index["player_actions"].get(player, 0), kept])
+    return {"version": SUMMARY_VERSION, "actions": index["actions"], "players": players}
+
+def index_from_summary(summary):
+    """The player index a summary was cut from (only SUMMARY_TYPES), or None if it is missing or stale."""
+    if not summary or summary.get("version") != SUMMARY_VERSION:
+        return None
+    players = {}
+    player_actions = {}
+    for player, actions, kept in summary["players"]:
+        players[player] = {msg_type: [count, first, last] for msg_type, count, first, last in kept}
+        player_actions[player] = actions
+    return {"players": players, "player_actions": player_actions, "actions": summary["actions"]}
+
+def sidecar_path(output_file, extension=".json.zst"):
+    base = output_file[:-len(extension)] if output_file.endswith(extension) else output_file
+    return base + SUMMARY_EXTENSION
+
+def make_sidecar(header, player_info, summary):
+    return {"header": header, "player_info": player_info, "summary": summary}
+
+def write_sidecar(output_file, sidecar):
+    with open(sidecar_path(output_file), "w", encoding="utf-8") as f:
+        json.dump(sidecar, f, separators=(",", ":"))
+
+def read_sidecar(output_file):
+    """Returns the sidecar dict, or None when there is none."""
+    try:
+        with open(sidecar_path(output_file), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def remove_sidecar(output_file):
+    try:
+        os.remove(sidecar_path(output_file))
+    except OSError:
+        pass
@@ -0,0 +1,211 @@
+import os
+import json
+import math
+import time
+import heapq
+import itertools
+import threading
+
+# ----------------------------
+# Per-Stage Timing
+# ----------------------------
+# Opt-in (TIME_STAGES in parse.py / parseV2.py). A worker times one replay
+# with a Laps object: lap("stage") charges the time since the previous lap to
+# that stage. The {stage: seconds} dict travels back with the worker's result,
+# the coordinator adds its own stages (dedup DB, writes) to it and files it
+# under the worker that produced it. At the end the per-worker reports are
+# merged into one: per-stage histograms (p50/p95/p99/max) plus the slowest
+# replays, dumped as JSON.
+#
+# Histograms use log-spaced buckets (BUCKETS_PER_OCTAVE per doubling, about
+# 4% wide), so memory stays flat for any number of replays and per-worker
+# histograms merge by adding counts. Percentiles are the bucket's upper bound,
+# capped at the exact maximum.
+BUCKETS_PER_OCTAVE = 16
+MIN_SECONDS = 1e-7
+SLOWEST_N = 20
+
+_sequence = itertools.count() # Breaks ties in the slowest heap
+
+class Laps:
+    def __init__(self, times=None):
+        self.times = {} if times is None else times
+        self.last = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.times[stage] = self.times.get(stage, 0.0) + now - self.last
+        self.last = now
+
+    def skip(self):
+        """Restarts the clock without charging the time to any stage."""
+        self.last = time.perf_counter()
+
+class NoLaps:
+    """Stands in for Laps when timing is off."""
+    times = None
+
+    def lap(self, stage):
+        pass
+
+    def skip(self):
+        pass
+
+NO_LAPS = NoLaps()
+
+def new_laps(enabled):
+    return Laps() if enabled else NO_LAPS
+
+def worker_id():
+    thread = threading.current_thread()
+    return f"{os.getpid()}" if thread is threading.main_thread() else f"{os.getpid()}/{thread.name}"
+
+def bucket_of(seconds):
+    if seconds <= MIN_SECONDS:
+        return 0
+    return int(math.log2(seconds / MIN_SECONDS) * BUCKETS_PER_OCTAVE) + 1
+
+def bucket_upper(bucket):
+    return MIN_SECONDS * 2 ** (bucket / BUCKETS_PER_OCTAVE)
+
+class Histogram:
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        bucket = bucket_of(seconds)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max: self.max = seconds
+
+    def merge(self, other):
+        for bucket, count in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, fraction):
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(fraction * self.count))
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(bucket_upper(bucket), self.max)
+        return self.max
+
+    def summary(self):
+        return {"count": self.count, "total_s": self.total, "mean_ms": self.total / self.count * 1000 if self.count else 0.0,
+                "p50_ms": self.percentile(0.50) * 1000, "p95_ms": self.percentile(0.95) * 1000,
+                "p99_ms": self.percentile(0.99) * 1000, "max_ms": self.max * 1000}
+
+class StageReport:
+    """Stage histograms, a per-replay total histogram and the slowest_n slowest replays."""
+
+    def __init__(self, slowest_n=SLOWEST_N):
+        self.slowest_n = slowest_n
+        self.stages = {}
+        self.replays = Histogram()
+        self.slowest = [] # min-heap of (total seconds, sequence, replay, {stage: seconds})
+
+    def add(self, replay, times):
+        if not times:
+            return
+        for stage, seconds in times.items():
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = Histogram()
+            histogram.add(seconds)
+        total = sum(times.values())
+        self.replays.add(total)
+        entry = (total, next(_sequence), replay, dict(times))
+        if len(self.slowest) < self.slowest_n:
+            heapq.heappush(self.slowest, entry)
+        elif total > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def merge(self, other):
+        for stage, histogram in other.stages.items():
+            self.stages.setdefault(stage, Histogram()).merge(histogram)
+        self.replays.merge(other.replays)
+        for entry in other.slowest:
+            if len(self.slowest) < self.slowest_n:
+                heapq.heappush(self.slowest, entry)
+            elif entry[0] > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, entry)
+
+    def to_dict(self):
+        return {
+            "replays": self.replays.summary(),
+            "stages": {stage: histogram.summary() for stage, histogram in self.stages.items()},
+            "slowest": [{"replay": replay, "total_ms": total * 1000, "stages_ms": {s: v * 1000 for s, v in times.items()}}
+                        for total, _, replay, times in sorted(self.slowest, reverse=True)]
+        }
+
+class StageTimings:
+    """Coordinator side: one StageReport per worker, merged on dump."""
+
+    def __init__(self, slowest_n=SLOWEST_N):
+        self.slowest_n = slowest_n
+        self.workers = {}
+
+    def add(self, worker, replay, times):
+        report = self.workers.get(worker)
+        if report is None:
+            report = self.workers[worker] = StageReport(self.slowest_n)
+        report.add(replay, times)
+
+    def merged(self):
+        report = StageReport(self.slowest_n)
+        for worker_report in self.workers.values():
+            report.merge(worker_report)
+        return report
+
+    def to_dict(self):
+        result = self.merged().to_dict()
+        result["workers"] = {worker: {"replays": r.replays.count, "total_s": r.replays.total} for worker, r in sorted(self.workers.items())}
+        return result
+
+    def dump(self, path):
+        result = self.to_dict()
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=1)
+        return result
+
+def dump_passes(path, passes):
+    """Writes {pass name: merged timings} for several StageTimings; returns the dict."""
+    result = {name: timings.to_dict() for name, timings in passes.items()}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=1)
+    return result
+
+def timed_results(results, timings, source_key):
+    """
+    Yields (result, laps) for worker results carrying "timings" and "worker"
+    keys; laps continues the worker's times for the coordinator's own stages.
+    Each replay is filed once the loop body is done with it (the generator
+    resumes on the next iteration). With timings None, laps is NO_LAPS.
+    """
+    for result in results:
+        times = result.pop("timings", None) if result and timings is not None else None
+        if times is None:
+            yield result, NO_LAPS
+            continue
+        worker = result.pop("worker", "?")
+        laps = Laps(times)
+        yield result, laps
+        timings.add(worker, result.get(source_key), laps.times)
+
+def print_summary(result, path=None):
+    print(f"Stage timings over {result['replays']['count']} replays" + (f" (written to {path}):" if path else ":"))
+    for stage, s in sorted(result["stages"].items(), key=lambda item: -item[1]["total_s"]):
+        print(f"  {stage:<14} {s['total_s']:9.3f}s  p50 {s['p50_ms']:8.3f}  p95 {s['p95_ms']:8.3f}  p99 {s['p99_ms']:8.3f}  max {s['max_ms']:9.3f} ms")
+    for entry in result["slowest"][:5]:
+        worst = max(entry["stages_ms"].items(), key=lambda item: item[1])
+        print(f"  slow: {entry['replay']} {entry['total_ms']:.1f} ms (mostly {worst[0]}, {worst[1]:.1f} ms)")
@@ -0,0 +1,270 @@
+import os
+import sys
+import json
+import struct
+import random
+from datetime import datetime, timezone
+from multiprocessing import Pool, cpu_count
+
+from replay_reader import MSG_END_GAME, MSG_SELF_DESTRUCT, MSG_LOGIC_CRC
+
+# ----------------------------
+# Synthetic Replay Corpus
+# ----------------------------
+# python synth_replays.py <out dir> <count> [seed] [option=json value ...]
+#   e.g. python synth_replays.py corpus 100000 7 players=[2] camera_per_minute=[300,600]
+#
+# Writes GENREP files that parse_rep_file and parseV2.parse_replay_data read
+# like real ones: full header, S=/M=/SD= game options, and per-player message
+# streams with LOGIC_CRCs every crc_interval frames, actions (including the
+# attack-object orders check_winner looks for), replay-camera spam,
+# self-destruct quits, idle tails and the end-of-game message.
+#
+# Replay i depends only on (seed, i): any slice of a corpus can be regenerated
+# on its own, workers split the range freely, and the same arguments always
+# give byte-identical files. Some files are another player's POV of the
+# previous match (duplicate_chance), so deduplication has work to do. Files
+# go to FILES_PER_DIR-sized subfolders named like the archive's
+# (<date>_<match type>_<n>.rep), with corpus.json recording the arguments.
+FILES_PER_DIR = 1000
+MANIFEST_FILE = "corpus.json"
+
+DEFAULT_OPTIONS = {
+    "players": [2, 2, 2, 2, 3, 4, 6, 8],     # Player count, picked per match
+    "frames": [3000, 40000],                # Match length range (30 frames per second)
+    "crc_interval": 100,                    # Frames between LOGIC_CRC messages
+    "actions_per_minute": [30, 250],        # Per-player range
+    "camera_per_minute": [0, 60],           # MSG_SET_REPLAY_CAMERA spam, per player
+    "attack_chance": 0.97,                  # Player issues MSG_DO_ATTACK_OBJECT at all
+    "quit_chance": 0.6,                     # Player self-destructs before the end
+    "double_quit_chance": 0.3,              # ...and sends a second self-destruct
+    "idle_chance": 0.2,                     # Player stops acting but keeps sending CRCs
+    "end_game_chance": 0.8,                 # Recording ends with MSG_END_GAME
+    "random_faction_chance": 0.3,
+    "observer_chance": 0.05,
+    "ai_chance": 0.02,
+    "no_team_chance": 0.05,
+    "desync_chance": 0.02,
+    "duplicate_chance": 0.3,                # File is another POV of the previous match
+    "maps": ["[RANK] Arctic Arena ZH v1", "[RANK] Snowy Roads ZH v1", "Alpine Assault v2", "Battle Park", "Lone Outpost",
+             "Tournament Desert", "Winter Wolf"],   # The first five are on parseV2's ALLOWED_MAPS
+    "version": "Version 1.04",
+    "start_time": 1704067200,               # First match start; later ones spread over start_days
+    "start_days": 365
+}
+
+MESSAGE_HEAD = struct.Struct('<IiiB')
+HEADER_TIMES = struct.Struct('<III')
+HEADER_VERSION = struct.Struct('<HHII')
+HEADER_TRAILER = struct.Struct('<iiii')
+
+# (type, argument signature as (arg type, count) runs, argument packer)
+ACTION_MESSAGES = [
+    (1001, [(2, 1), (5, 3)], lambda rng: struct.pack('<?III', True, *(rng.getrandbits(16) for _ in range(3)))),  # MSG_CREATE_SELECTED_GROUP
+    (1068, [(6, 1)], lambda rng: struct.pack('<fff', rng.uniform(0, 4000), rng.uniform(0, 4000), 0.0)),            # MSG_DO_MOVETO
+    (1059, [(5, 1)], lambda rng: struct.pack('<I', rng.getrandbits(16))),                                           # MSG_DO_ATTACK_OBJECT
+    (1049, [(5, 1), (6, 1), (1, 1)], lambda rng: struct.pack('<Iffff', rng.getrandbits(16), rng.uniform(0, 4000), rng.uniform(0, 4000), 0.0, rng.uniform(0, 6.28))),  # MSG_DOZER_CONSTRUCT
+    (1047, [(0, 2)], lambda rng: struct.pack('<ii', rng.randrange(400), 1)),                                       # MSG_QUEUE_UNIT_CREATE
+]
+ACTION_WEIGHTS = [25, 35, 15, 10, 15]
+MSG_DO_ATTACK_OBJECT = 1059
+MSG_SET_REPLAY_CAMERA = 1092
+CAMERA_SIGNATURE = [(6, 2), (1, 1), (7, 1)]
+
+def encode_message(frame, msg_type, player, signature, args):
+    return MESSAGE_HEAD.pack(frame, msg_type, player, len(signature)) + bytes(v for run in signature for v in run) + args
+
+def utf16z(text):
+    return text.encode('utf-16-le') + b'\0\0'
+
+def match_rng(seed, number):
+    return random.Random(f"{seed}:match:{number}")
+
+def make_match(seed, number, options):
+    """Everything every POV of match `number` shares: slots, seed, length and per-player behaviour."""
+    rng = match_rng(seed, number)
+    count = rng.choice(options["players"])
+    no_teams = count > 2 and rng.random() < options["no_team_chance"]
+    slots = []
+    for i in range(count):
+        observer = i == count - 1 and count > 2 and rng.random() < options["observer_chance"]
+        slots.append({
+            "name": f"Player{number % 9973}_{i}",
+            "ai": i > 0 and rng.random() < options["ai_chance"],
+            "color": -1 if rng.random() < options["random_faction_chance"] else rng.randrange(8),
+            "template": -2 if observer else (-1 if rng.random() < options["random_faction_chance"] else rng.randrange(12)),
+            "team": -1 if observer or no_teams else (i % 2 if count != 3 else i),
+            "position": i
+        })
+    frames = rng.randint(*options["frames"])
+    players = []
+    for i in range(count):
+        quit_frame = rng.randint(frames // 3, frames - 1) if rng.random() < options["quit_chance"] else None
+        players.append({
+            "seed": rng.getrandbits(64),
+            "quit": quit_frame,
+            "double_quit": quit_frame is not None and rng.random() < options["double_quit_chance"],
+            "idle_from": rng.randint(frames // 4, frames) if rng.random() < options["idle_chance"] else None,
+            "apm": rng.uniform(*options["actions_per_minute"]),
+            "camera_pm": rng.uniform(*options["camera_per_minute"]),
+            "attacks": rng.random() < options["attack_chance"],
+            "observer": slots[i]["template"] == -2
+        })
+    return {
+        "number": number,
+        "game_seed": rng.getrandbits(31),
+        "map": rng.choice(options["maps"]),
+        "start_time": options["start_time"] + rng.randrange(options["start_days"] * 86400),
+        "frames": frames,
+        "slots": slots,
+        "players": players,
+        "desync": rng.random() < options["desync_chance"],
+        "end_game": rng.random() < options["end_game_chance"]
+    }
+
+def match_type(match):
+    teams = {}
+    for i, slot in enumerate(match["slots"]):
+        if slot["template"] == -2:
+            continue
+        key = slot["team"] if slot["team"] >= 0 else f"solo{i}"
+        teams[key] = teams.get(key, 0) + 1
+    if len(teams) > 2 and all(n == 1 for n in teams.values()):
+        return "ffa"
+    return "v".join(str(n) for n in sorted(teams.values()))
+
+def game_options(match):
+    entries = []
+    for i, slot in enumerate(match["slots"]):
+        if slot["ai"]:
+            entries.append(f"CE,{slot['color']},{slot['template']},{slot['position']},{slot['team']}")
+        else:
+            entries.append(f"H{slot['name']},C0A8{i:04X},8088,TT,{slot['color']},{slot['template']},{slot['position']},{slot['team']},1")
+    entries += ["X"] * (8 - len(entries))
+    return (f"US=1;M=maps/{match['map'].lower()};MC=ABCD{match['number'] % 65536:04X};MS=1;SD={match['game_seed']};"
+            f"C=100;SR=0;SC=10000;O=N;S={':'.join(entries)}:;")
+
+def player_messages(match, index, end_frame, options):
+    """(frame, order, bytes) for everything player `index` sends up to end_frame."""
+    player = match["players"][index]
+    if match["slots"][index]["ai"]:
+        return [] # AI orders are not networked
+    number = 2 + index
+    rng = random.Random(player["seed"])
+    quit_frame = player["quit"]
+    last = min(end_frame, quit_frame + 40 if quit_frame is not None else end_frame)
+    events = []
+    for frame in range(options["crc_interval"], last + 1, options["crc_interval"]):
+        events.append((frame, 0, encode_message(frame, MSG_LOGIC_CRC, number, [(0, 1), (2, 1)], struct.pack('<i?', rng.getrandbits(31), True))))
+    if player["observer"]:
+        return events
+    active_until = min(last, player["idle_from"] or last, quit_frame or last)
+    minutes = active_until / 1800
+    for frame in sorted(rng.randrange(1, max(2, active_until)) for _ in range(int(player["apm"] * minutes))):
+        msg_type, signature, pack = rng.choices(ACTION_MESSAGES, ACTION_WEIGHTS)[0]
+        if msg_type == MSG_DO_ATTACK_OBJECT and not player["attacks"]:
+            msg_type, signature, pack = ACTION_MESSAGES[1]
+        events.append((frame, 1, encode_message(frame, msg_type, number, signature, pack(rng))))
+    for frame in sorted(rng.randrange(1, max(2, last)) for _ in range(int(player["camera_pm"] * last / 1800))):
+        args = struct.pack('<6ffii', *(rng.uniform(0, 4000) for _ in range(6)), rng.uniform(0.5, 2.0), 0, 0)
+        events.append((frame, 1, encode_message(frame, MSG_SET_REPLAY_CAMERA, number, CAMERA_SIGNATURE, args)))
+    if quit_frame is not None and quit_frame <= end_frame:
+        events.append((quit_frame, 2, encode_message(quit_frame, MSG_SELF_DESTRUCT, number, [(2, 1)], b'\x01')))
+        if player["double_quit"] and quit_frame + 30 <= end_frame:
+            events.append((quit_frame + 30, 2, encode_message(quit_frame + 30, MSG_SELF_DESTRUCT, number, [(2, 1)], b'\x01')))
+    return events
+
+def encode_replay(match, local_index, options):
+    """The .rep bytes of match as recorded by slot local_index."""
+    quit_frame = match["players"][local_index]["quit"]
+    # A player who quit stops recording shortly after
+    end_frame = min(match["frames"], quit_frame + 60) if quit_frame is not None else match["frames"]
+    header = bytearray(b'GENREP')
+    header += HEADER_TIMES.pack(match["start_time"], match["start_time"] + end_frame // 30, end_frame)
+    header += bytes([1 if match["desync"] else 0, 1 if quit_frame is not None else 0]) + bytes(8)
+    header += utf16z("Last Replay")
+    system_time = datetime.fromtimestamp(match["start_time"], timezone.utc)
+    header += struct.pack('<8H', system_time.year, system_time.month, system_time.isoweekday() % 7, system_time.day,
+                          system_time.hour, system_time.minute, system_time.second, 0)
+    header += utf16z(options["version"]) + utf16z("Mar 10 2005 13:47:03")
+    header += HEADER_VERSION.pack(4, 1, 3660270360, 4272612339)
+    header += game_options(match).encode('ascii') + b'\0' + str(local_index).encode('ascii') + b'\0'
+    header += HEADER_TRAILER.pack(0, 0, 0, 30)
+    events = []
+    for index in range(len(match["slots"])):
+        events += player_messages(match, index, end_frame, options)
+    events.sort(key=lambda e: (e[0], e[1]))
+    body = b"".join(e[2] for e in events)
+    if match["end_game"] and quit_frame is None:
+        body += encode_message(end_frame, MSG_END_GAME, 2 + local_index, [], b'')
+    return bytes(header) + body
+
+def replay_file(seed, i, options):
+    """Returns (relative path, bytes) of file i of the corpus."""
+    rng = random.Random(f"{seed}:file:{i}")
+    number = i - 1 if i > 0 and rng.random() < options["duplicate_chance"] else i
+    match = make_match(seed, number, options)
+    povs = [k for k, slot in enumerate(match["slots"]) if not slot["ai"]]
+    local_index = povs[0] if number == i else rng.choice(povs)
+    date = datetime.fromtimestamp(match["start_time"], timezone.utc).strftime('%Y-%m-%d')
+    name = f"{date}_{match_type(match)}_{i}.rep"
+    return os.path.join(f"{i // FILES_PER_DIR:04d}", name), encode_replay(match, local_index, options)
+
+def write_range(args):
+    out_dir, seed, start, stop, options = args
+    written = 0
+    for i in range(start, stop):
+        path, data = replay_file(seed, i, options)
+        path = os.path.join(out_dir, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        written += len(data)
+    return stop - start, written
+
+def generate_corpus(out_dir, count, seed=0, options=None, workers=None, start=0):
+    """Writes files start..count-1 of the corpus; returns (files, bytes)."""
+    options = {**DEFAULT_OPTIONS, **(options or {})}
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump({"count": count, "seed": seed, "options": options}, f, indent=1)
+    workers = workers or max(1, cpu_count() - 1)
+    step = FILES_PER_DIR
+    ranges = [(out_dir, seed, i, min(i + step, count), options) for i in range(start, count, step)]
+    files = size = 0
+    if workers <= 1 or len(ranges) <= 1:
+        results = map(write_range, ranges)
+        pool = None
+    else:
+        pool = Pool(processes=workers)
+        results = pool.imap_unordered(write_range, ranges)
+    try:
+        for done, written in results:
+            files += done; size += written
+            print(f"\r  {files}/{count - start} replays, {size / 1e6:.1f} MB", end="")
+    finally:
+        if pool is not None:
+            pool.close(); pool.join()
+    print()
+    return files, size
+
+def main():
+    if len(sys.argv) < 3:
+        print("Usage: python synth_replays.py <out dir> <count> [seed] [option=json value ...]")
+        print("Options: " + ", ".join(DEFAULT_OPTIONS))
+        sys.exit(2)
+    out_dir, count = sys.argv[1], int(sys.argv[2])
+    rest = sys.argv[3:]
+    seed = int(rest.pop(0)) if rest and "=" not in rest[0] else 0
+    options = {}
+    for arg in rest:
+        key, value = arg.split("=", 1)
+        if key not in DEFAULT_OPTIONS:
+            print(f"Unknown option: {key}")
+            sys.exit(2)
+        options[key] = json.loads(value)
+    files, size = generate_corpus(out_dir, count, seed, options)
+    print(f"Wrote {files} replays ({size / 1e6:.1f} MB) to {out_dir} (seed {seed})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import os
+import sys
+import glob
+import time
+import random
+import threading
+import zstandard as zstd
+
+# ----------------------------
+# Shared Compression Dictionary
+# ----------------------------
+# Parsed outputs share most of their structure (header and player_info keys,
+# message layout), which small files cannot exploit when each is compressed
+# on its own. A dictionary trained from existing outputs is stored next to
+# them as dict_<id>.zdict. Every zstd frame records the id of the dictionary
+# it was written with, so readers load the matching one from the file's
+# folder, and files written without a dictionary still read as before.
+#
+# Compressor/decompressor contexts are created once per thread and reused.
+#
+# Retrain: python zstd_dict.py [folder] [dict size in KiB]
+DICT_PREFIX = "dict_"
+DICT_EXTENSION = ".zdict"
+DICT_SIZE = 110 * 1024
+LEVEL = 3
+TRAIN_MAX_FILES = 2000
+
+_dictionaries = {}
+_dict_lock = threading.Lock()
+_contexts = threading.local()
+
+def dictionary_path(folder, dict_id):
+    return os.path.join(folder, f"{DICT_PREFIX}{dict_id}{DICT_EXTENSION}")
+
+def load_dictionary(folder, dict_id):
+    key = (os.path.abspath(folder), dict_id)
+    with _dict_lock:
+        dictionary = _dictionaries.get(key)
+    if dictionary is None:
+        path = dictionary_path(folder, dict_id)
+        try:
+            with open(path, "rb") as f:
+                dictionary = zstd.ZstdCompressionDict(f.read())
+        except OSError:
+            raise ValueError(f"Compression dictionary {dict_id} not found (expected {path})")
+        with _dict_lock:
+            _dictionaries[key] = dictionary
+    return dictionary
+
+def latest_dictionary(folder):
+    """The most recently trained dictionary in folder, or None."""
+    paths = glob.glob(os.path.join(folder, f"{DICT_PREFIX}*{DICT_EXTENSION}"))
+    if not paths:
+        return None
+    newest = max(paths, key=os.path.getmtime)
+    return load_dictionary(folder, int(os.path.basename(newest)[len(DICT_PREFIX):-len(DICT_EXTENSION)]))
+
+def get_compressor(dictionary=None, level=LEVEL):
+    compressors = _contexts.__dict__.setdefault("compressors", {})
+    key = (dictionary.dict_id() if dictionary else 0, level)
+    cctx = compressors.get(key)
+    if cctx is None:
+        if dictionary:
+            dictionary.precompute_compress(level=level)
+            cctx = zstd.ZstdCompressor(level=level, dict_data=dictionary)
+        else:
+            cctx = zstd.ZstdCompressor(level=level)
+        compressors[key] = cctx
+    return cctx
+
+def get_decompressor(dictionary=None):
+    decompressors = _contexts.__dict__.setdefault("decompressors", {})
+    key = dictionary.dict_id() if dictionary else 0
+    dctx = decompressors.get(key)
+    if dctx is None:
+        dctx = zstd.ZstdDecompressor(dict_data=dictionary) if dictionary else zstd.ZstdDecompressor()
+        decompressors[key] = dctx
+    return dctx
+
+def compress(data, dictionary=None, level=LEVEL):
+    return get_compressor(dictionary, level).compress(data)
+
+def decompress(data, folder=".", max_output_size=0):
+    """Decompresses one frame, loading the dictionary it names from folder."""
+    dict_id = zstd.get_frame_parameters(data).dict_id
+    dictionary = load_dictionary(folder, dict_id) if dict_id else None
+    return get_decompressor(dictionary).decompress(data, max_output_size=max_output_size)
+
+# ----------------------------
+# Training
+# ----------------------------
+def output_samples(path):
+    """The uncompressed units a parsed output is compressed as: the whole JSON, or each .rcol block."""
+    import replay_columns
+    if path.endswith(replay_columns.EXTENSION):
+        return replay_columns.read_raw_blocks(path)
+    with open(path, "rb") as f:
+        return [decompress(f.read(), os.path.dirname(path))]
+
+def measure(samples, dictionary=None, level=LEVEL, rounds=3):
+    """Returns (compressed bytes, decompression MB/s) for samples compressed one by one."""
+    frames = [compress(s, dictionary, level) for s in samples]
+    dctx = get_decompressor(dictionary)
+    raw_size = sum(len(s) for s in samples)
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for frame, sample in zip(frames, samples):
+            dctx.decompress(frame, max_output_size=len(sample))
+        best = min(best, time.perf_counter() - start)
+    return sum(len(f) for f in frames), raw_size / 1e6 / best if best > 0 else 0.0
+
+def train(folder, dict_size=DICT_SIZE, max_files=TRAIN_MAX_FILES, level=LEVEL, seed=0):
+    """
+    Trains a dictionary on a sample of the outputs in folder and saves it there.
+    A fifth of the sampled files are held out of training and used to compare
+    size and decompression speed with and without the dictionary.
+    Returns (dictionary path, report dict).
+    """
+    paths = sorted(glob.glob(os.path.join(folder, "*.rcol")) + glob.glob(os.path.join(folder, "*.json.zst")))
+    if len(paths) < 10:
+        raise ValueError(f"Need at least 10 parsed outputs in {folder} to train, found {len(paths)}")
+    rng = random.Random(seed)
+    paths = rng.sample(paths, min(max_files, len(paths)))
+    held_out = paths[:max(1, len(paths) // 5)]
+    training = [s for p in paths[len(held_out):] for s in output_samples(p)]
+    testing = [s for p in held_out for s in output_samples(p)]
+    dictionary = zstd.train_dictionary(dict_size, training, level=level)
+    path = dictionary_path(folder, dictionary.dict_id())
+    with open(path, "wb") as f:
+        f.write(dictionary.as_bytes())
+    plain_size, plain_speed = measure(testing, None, level)
+    dict_size_out, dict_speed = measure(testing, dictionary, level)
+    report = {"files": len(paths), "held_out_files": len(held_out), "raw_bytes": sum(len(s) for s in testing),
+              "plain_bytes": plain_size, "dict_bytes": dict_size_out, "plain_mb_s": plain_speed, "dict_mb_s": dict_speed,
+              "dict_id": dictionary.dict_id(), "dict_size": len(dictionary.as_bytes())}
+    return path, report
+
+def main():
+    folder = sys.argv[1] if len(sys.argv) > 1 else "."
+    dict_size = int(sys.argv[2]) * 1024 if len(sys.argv) > 2 else DICT_SIZE
+    try:
+        path, r = train(folder, dict_size)
+    except (ValueError, zstd.ZstdError) as e:
+        print(f"Training failed: {e}")
+        sys.exit(1)
+    print(f"Trained dictionary {r['dict_id']} ({r['dict_size'] / 1024:.1f} KiB) from {r['files'] - r['held_out_files']} files -> {path}")
+    print(f"Held-out {r['held_out_files']} files, {r['raw_bytes'] / 1024:.1f} KiB raw:")
+    print(f"  without dictionary: {r['plain_bytes'] / 1024:.1f} KiB, decompress {r['plain_mb_s']:.0f} MB/s")
+    print(f"  with dictionary:    {r['dict_bytes'] / 1024:.1f} KiB ({(1 - r['dict_bytes'] / r['plain_bytes']) * 100:.1f}% smaller), decompress {r['dict_mb_s']:.0f} MB/s")
+    print("New outputs written by parse.py use the newest dictionary in the output folder.")
+
+if __name__ == "__main__":
+    main()